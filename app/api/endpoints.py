@@ -1,40 +1,51 @@
 import logging
 import secrets
-from datetime import datetime, timedelta
-from typing import List
-
-import aioredis
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
 
 from fastapi import APIRouter, HTTPException, Depends, Request, Form
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import PlainTextResponse
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.templating import Jinja2Templates
 
 from pydantic import BaseModel, Field
 
-from sqlalchemy import delete
+from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app.core.config import settings
+from app.core.resources import redis_client
+from app.core.logging_config import log_body
+from app.core.metrics import metrics
+from app.core.responses import ORJSONResponse
+from app.core.static_assets import asset_url
 from app.core.status_codes import StatusMessages
 from app.db.init_db import get_db
-from app.db.models import Message, Tab, TelegramMessage, User
+from app.db.models import Tab, User
 from app.schemas.token import Token
 from app.schemas.user import RegisterUser
 from app.services.auth import AuthService
+from app.services.balance_cache import BalanceCache
+from app.services.chat_service import ChatService
+from app.services.idempotency_service import IdempotencyService
+from app.services.job_service import JobService
 from app.services.message_limit import MessageLimitService
-from app.services.openai_service import OpenAIService, OpenAIServiceTelegramBot
+from app.services.search_service import SearchService
+from app.services.tab_service import TabService
 from app.services.token_service import TokenService
+from app.services.transfer_service import TransferService
+from app.services.usage_service import UsageService
 
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 
 templates = Jinja2Templates(directory="app/templates")
-redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+templates.env.globals["asset_url"] = asset_url
 daily_message_limit = settings.DAILY_MESSAGE_LIMIT
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
@@ -47,8 +58,9 @@ class MessageContext(BaseModel):
 class Question(BaseModel):
     user_id: int
     question: str
-    context: List[MessageContext]
+    context: List[MessageContext] = []
     source: str
+    callback_url: Optional[str] = None
 
 
 class RenameTabRequest(BaseModel):
@@ -59,6 +71,26 @@ def generate_bot_token(user_id: int) -> str:
     return secrets.token_urlsafe(32)
 
 
+async def current_user_id(request: Request, db: AsyncSession) -> int:
+    # From the token's "uid" claim; tokens issued before the claim
+    # existed fall back to looking the user up.
+    user_id = AuthService.get_current_user_id(request)
+    if user_id is None:
+        try:
+            current_user = await AuthService.get_current_user(request, db)
+        except HTTPException:
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        user_id = current_user.id
+    return user_id
+
+
+async def client_disconnected(request: Request) -> None:
+    # Returns when the client closes the connection. The body has been
+    # read by then, so the next message from the server is the disconnect.
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
 @router.get("/", response_class=HTMLResponse)
 async def read_root(request: Request, db: AsyncSession = Depends(get_db)):
     try:
@@ -67,7 +99,7 @@ async def read_root(request: Request, db: AsyncSession = Depends(get_db)):
             "request": request,
             "current_user": current_user,
             "telegram_bot_url": settings.TELEGRAM_BOT_URL,
-            "tokens_remaining": current_user.tokens
+            "tokens_remaining": await BalanceCache.get(current_user.id, db)
         }
 
         if current_user:
@@ -94,26 +126,16 @@ async def chat_page(request: Request, db: AsyncSession = Depends(get_db)):
     try:
         current_user = await AuthService.get_current_user(request, db)
 
-        tabs_query = await db.execute(
-            select(Tab).filter(Tab.user_id == current_user.id)
-        )
-        tabs = tabs_query.scalars().all()
+        tabs = await TabService.list_tabs(db, current_user.id)
 
         if not tabs:
             new_tab = Tab(user_id=current_user.id, name="New Tab")
             db.add(new_tab)
             await db.commit()
+            await db.refresh(new_tab)
             tabs = [new_tab]
 
-        tab_data = [
-            {
-                "id": tab.id,
-                "name": tab.name,
-                "created_at": tab.created_at.isoformat(),
-                "updated_at": tab.updated_at.isoformat() if tab.updated_at else None
-            }
-            for tab in tabs
-        ]
+        tab_data = [TabService.tab_summary(tab) for tab in tabs]
 
         first_tab_id = tab_data[0]['id'] if tab_data else None
 
@@ -122,7 +144,9 @@ async def chat_page(request: Request, db: AsyncSession = Depends(get_db)):
             {
                 "request": request,
                 "current_user": current_user,
-                "tokens_remaining": current_user.tokens,
+                "tokens_remaining": await BalanceCache.get(
+                    current_user.id, db
+                ),
                 "tabs": tab_data,
                 "first_tab_id": first_tab_id
             }
@@ -145,6 +169,16 @@ async def chat(
             detail=StatusMessages.UNAUTHORIZED
         )
 
+    return await IdempotencyService.run(
+        redis_client, request, current_user.id, "chat", message,
+        lambda: answer_chat(message, request, db, current_user),
+        deadline=settings.CHAT_DEADLINE
+    )
+
+
+async def answer_chat(
+    message: dict, request: Request, db: AsyncSession, current_user: User
+):
     user_id = current_user.id
 
     tab_id = message.get("tab_id")
@@ -154,22 +188,15 @@ async def chat(
             detail="Tab identifier is not specified."
         )
 
-    tab_query = await db.execute(
-        select(Tab).filter(
-            Tab.id == tab_id,
-            Tab.user_id == user_id
-        )
-    )
-    tab = tab_query.scalar_one_or_none()
-
-    if not tab:
-        raise HTTPException(status_code=404, detail="Tab not found.")
+    tab = await TabService.get_user_tab(db, user_id, tab_id)
 
     if len(message['message']) > 1000:
         return {
             "response": "The maximum message length is 1000 characters.",
             "error": True
         }
+    JobService.check_callback_url(message.get("callback_url"))
+
     try:
         await MessageLimitService.check_and_increment_question_count(
             redis_client,
@@ -185,59 +212,24 @@ async def chat(
     if not await TokenService.deduct_tokens(user_id, tokens_needed, db):
         return {"response": "Insufficient tokens.", "error": True}
 
-    context_query = await db.execute(
-        select(Message)
-        .filter(Message.tab_id == tab_id)
-        .order_by(Message.created_at.asc())
-        .limit(settings.MAX_CONTEXT_MESSAGES)
-    )
-    context = [
-        {"role": msg.content["role"],
-         "content": msg.content["content"]} for msg in context_query.scalars().all()
-    ]
-
-    try:
-        response_text, updated_context = await OpenAIService.ask_question(
-            message['message'], context
-        )
-        tokens_used = TokenService.count_tokens(response_text)
-        if not await TokenService.deduct_tokens(user_id, tokens_used, db):
-            return {
-                "response": "Not enough tokens to get a response.",
-                "error": True
-            }
-
-        new_message = Message(
-            tab_id=tab.id,
-            content={"role": "user",
-                     "content": message['message']}
+    if JobService.wants_async(request):
+        job_id = await JobService.enqueue(redis_client, "chat", {
+            "user_id": user_id,
+            "tab_id": tab.id,
+            "text": message['message'],
+            "tokens_needed": tokens_needed,
+            "callback_url": message.get("callback_url"),
+        })
+        return JSONResponse(
+            status_code=202, content=JobService.accepted(job_id)
         )
-        db.add(new_message)
-        await db.commit()
 
-        assistant_message = Message(
-            tab_id=tab.id,
-            content={"role": "assistant",
-                     "content": response_text}
+    try:
+        return await ChatService.answer_in_tab(
+            db, current_user, tab, message['message'], tokens_needed,
+            stop=lambda: client_disconnected(request),
+            deadline=settings.CHAT_DEADLINE
         )
-        db.add(assistant_message)
-        await db.commit()
-
-        current_user.tokens -= (tokens_needed + tokens_used)
-        await db.commit()
-
-        tab_data = {
-            "id": tab.id,
-            "name": tab.name,
-            "created_at": tab.created_at.isoformat(),
-            "updated_at": tab.updated_at.isoformat() if tab.updated_at else None
-        }
-
-        return {
-            "response": response_text,
-            "tokens_remaining": current_user.tokens,
-            "tab": tab_data
-        }
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -263,7 +255,9 @@ async def ask_telegram(
     request: Request,
     db: AsyncSession = Depends(get_db)
 ):
-    logger.info(f"Received request on /ask_telegram: {question.question}")
+    logger.info(
+        f"Received request on /ask_telegram: {log_body(question.question)}"
+    )
 
     try:
         current_user = await AuthService.get_current_user(request, db)
@@ -274,6 +268,17 @@ async def ask_telegram(
             detail=StatusMessages.UNAUTHORIZED
         )
 
+    return await IdempotencyService.run(
+        redis_client, request, current_user.id, "ask_telegram",
+        question.model_dump(),
+        lambda: answer_telegram(question, request, db, current_user),
+        deadline=settings.TELEGRAM_DEADLINE
+    )
+
+
+async def answer_telegram(
+    question: Question, request: Request, db: AsyncSession, current_user: User
+):
     user_id = current_user.id
 
     if len(question.question) > 1000:
@@ -283,6 +288,8 @@ async def ask_telegram(
             "error": True
         }
 
+    JobService.check_callback_url(question.callback_url)
+
     try:
         await MessageLimitService.check_and_increment_question_count(
             redis_client, user_id
@@ -300,31 +307,23 @@ async def ask_telegram(
             "error": True
         }
 
-    context_query = await db.execute(
-        select(TelegramMessage)
-        .filter(TelegramMessage.user_id == user_id)
-        .order_by(TelegramMessage.created_at.asc())
-        .limit(settings.MAX_CONTEXT_MESSAGES)
-    )
-    context = [
-        {"role": msg.message["role"], "content": msg.message["content"]}
-        for msg in context_query.scalars().all()
-    ]
+    if JobService.wants_async(request):
+        job_id = await JobService.enqueue(redis_client, "telegram", {
+            "user_id": user_id,
+            "text": question.question,
+            "tokens_needed": tokens_needed,
+            "callback_url": question.callback_url,
+        })
+        return JSONResponse(
+            status_code=202, content=JobService.accepted(job_id)
+        )
 
     try:
-        response_text, updated_context = await OpenAIServiceTelegramBot.ask_question(question.question, context)
-        tokens_used = TokenService.count_tokens(response_text)
-        if not await TokenService.deduct_tokens(user_id, tokens_used, db):
-            return {
-                "response": "Not enough tokens to receive the answer.",
-                "error": True
-            }
-
-        return {
-            "response": response_text,
-            "tokens_used": tokens_needed + tokens_used,
-            "tokens_remaining": current_user.tokens
-        }
+        return await ChatService.answer_in_telegram(
+            db, current_user, question.question, tokens_needed,
+            stop=lambda: client_disconnected(request),
+            deadline=settings.TELEGRAM_DEADLINE
+        )
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -358,7 +357,8 @@ async def login(
         minutes=AuthService.ACCESS_TOKEN_EXPIRE_MINUTES
     )
     access_token = AuthService.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id},
+        expires_delta=access_token_expires
     )
     response = JSONResponse(content={"success": True, "redirect": "/"})
     response.set_cookie(key="access_token", value=access_token, httponly=True)
@@ -382,7 +382,7 @@ async def register_user_form(
             content={"error": "Email is already registered"}, status_code=400
         )
 
-    hashed_password = AuthService.pwd_context.hash(password)
+    hashed_password = AuthService.pwd_context().hash(password)
     new_user = User(email=email, hashed_password=hashed_password)
     db.add(new_user)
     try:
@@ -423,7 +423,7 @@ async def register_user(
                 detail="Email is already registered"
             )
 
-        hashed_password = AuthService.pwd_context.hash(register_user.password)
+        hashed_password = AuthService.pwd_context().hash(register_user.password)
         new_user = User(
             email=register_user.email,
             hashed_password=hashed_password,
@@ -462,7 +462,7 @@ async def logout(request: Request):
 @router.get("/health")
 async def health_check(db: AsyncSession = Depends(get_db)):
     try:
-        await db.execute("SELECT 1")
+        await db.execute(text("SELECT 1"))
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
@@ -471,6 +471,66 @@ async def health_check(db: AsyncSession = Depends(get_db)):
         }
 
 
+async def get_own_job(job_id: str, request: Request, db: AsyncSession):
+    try:
+        current_user = await AuthService.get_current_user(request, db)
+    except HTTPException:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    owner = await redis_client.hget(f"job:{job_id}", "user_id")
+    if owner is None or int(owner) != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    await get_own_job(job_id, request, db)
+    return await JobService.get(redis_client, job_id)
+
+
+@router.get("/jobs/{job_id}/events")
+async def get_job_events(
+    job_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    await get_own_job(job_id, request, db)
+    return StreamingResponse(
+        JobService.events(redis_client, job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request):
+    # Only for scrapers holding METRICS_TOKEN; without one configured the
+    # endpoint does not exist.
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("Authorization", "")
+    if not secrets.compare_digest(
+        authorization.encode(), f"Bearer {settings.METRICS_TOKEN}".encode()
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid metrics token.",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return metrics.render()
+
+
+@router.get("/ready")
+async def readiness_check(request: Request):
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(content={"status": "not ready"}, status_code=503)
+    return {"status": "ready"}
+
+
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
@@ -489,7 +549,8 @@ async def login_for_access_token(
         minutes=AuthService.ACCESS_TOKEN_EXPIRE_MINUTES
     )
     access_token = AuthService.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id},
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -509,7 +570,8 @@ async def refresh_token(request: Request, db: AsyncSession = Depends(get_db)):
         minutes=AuthService.ACCESS_TOKEN_EXPIRE_MINUTES
     )
     access_token = AuthService.create_access_token(
-        data={"sub": current_user.email}, expires_delta=access_token_expires
+        data={"sub": current_user.email, "uid": current_user.id},
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -538,7 +600,8 @@ async def verify_token(token_data: dict, db: AsyncSession = Depends(get_db)):
         minutes=AuthService.ACCESS_TOKEN_EXPIRE_MINUTES
     )
     access_token = AuthService.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id},
+        expires_delta=access_token_expires
     )
 
     return {
@@ -553,12 +616,59 @@ async def get_token_balance(
     request: Request,
     db: AsyncSession = Depends(get_db)
 ):
-    try:
-        current_user = await AuthService.get_current_user(request, db)
-    except HTTPException:
+    user_id = await current_user_id(request, db)
+    tokens_remaining = await BalanceCache.get(user_id, db)
+    if tokens_remaining is None:
         raise HTTPException(status_code=401, detail="Unauthorized")
+    return {"tokens_remaining": tokens_remaining}
+
+
+@router.get("/usage")
+async def get_usage(
+    request: Request,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    bucket: str = "day",
+    db: AsyncSession = Depends(get_db)
+):
+    user_id = await current_user_id(request, db)
 
-    return {"tokens_remaining": current_user.tokens}
+    # Defaults to the current month so far (UTC).
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end.replace(day=1)
+    return await UsageService.summary(db, user_id, start, end, bucket)
+
+
+@router.get("/search")
+async def search_messages(
+    request: Request,
+    q: str,
+    source: str = "all",
+    limit: int = 20,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db)
+):
+    user_id = await current_user_id(request, db)
+    return await SearchService.search(db, user_id, q, source, limit, offset)
+
+
+@router.get("/export")
+async def export_history(request: Request, db: AsyncSession = Depends(get_db)):
+    user_id = await current_user_id(request, db)
+    return StreamingResponse(
+        TransferService.export_chunks(user_id),
+        media_type="application/gzip",
+        headers={
+            "Content-Disposition":
+                f'attachment; filename="chat-history-{user_id}.ndjson.gz"'
+        }
+    )
+
+
+@router.post("/import")
+async def import_history(request: Request, db: AsyncSession = Depends(get_db)):
+    user_id = await current_user_id(request, db)
+    return await TransferService.import_chunks(db, user_id, request.stream())
 
 
 @router.get("/get_tab_messages/{tab_id}")
@@ -566,15 +676,9 @@ async def get_tab_messages(tab_id: int, db: AsyncSession = Depends(get_db)):
     try:
         tab_id = int(tab_id)
 
-        messages_query = await db.execute(
-            select(Message).filter(Message.tab_id == tab_id).order_by(Message.created_at.asc())
-        )
-        messages = messages_query.scalars().all()
-
-        return [
-            {"sender": "user" if msg.content["role"] == "user" else "assistant",
-             "text": msg.content["content"]} for msg in messages
-        ]
+        # Returned as a response so FastAPI skips jsonable_encoder, which
+        # dominates the cost for long tabs.
+        return ORJSONResponse(await TabService.tab_messages(db, tab_id))
 
     except Exception as e:
         logger.error(f"Error loading tab messages: {str(e)}")
@@ -592,16 +696,10 @@ async def create_tab(request: Request, db: AsyncSession = Depends(get_db)):
             f"Creating a new tab for user: {current_user.email}"
         )
 
-        new_tab = Tab(user_id=current_user.id, name="New Tab")
-        db.add(new_tab)
-        await db.commit()
-        await db.refresh(new_tab)
+        new_tab = await TabService.create_tab(db, current_user.id)
 
-        logger.info(f"New tab: {new_tab.id} with name: {new_tab.name}")
-        return {
-            "tab_id": new_tab.id,
-            "name": new_tab.name
-        }
+        logger.info(f"New tab: {new_tab['tab_id']} with name: {new_tab['name']}")
+        return new_tab
     except Exception as e:
         logger.error(f"Error creating new tab: {str(e)}")
         raise HTTPException(
@@ -620,18 +718,9 @@ async def rename_tab(
     try:
         current_user = await AuthService.get_current_user(request, db)
 
-        tab_query = await db.execute(
-            select(Tab).filter(Tab.id == tab_id, Tab.user_id == current_user.id)
+        return await TabService.rename_tab(
+            db, current_user.id, tab_id, rename_request.new_name
         )
-        tab = tab_query.scalar_one_or_none()
-
-        if tab is None:
-            raise HTTPException(status_code=404, detail="Tab not found")
-
-        tab.name = rename_request.new_name
-        await db.commit()
-
-        return {"tab_id": tab.id, "new_name": tab.name}
 
     except Exception as e:
         logger.error(f"Error renaming tab: {str(e)}")
@@ -649,21 +738,7 @@ async def delete_tab(
     try:
         current_user = await AuthService.get_current_user(request, db)
 
-        tab_query = await db.execute(
-            select(Tab).filter(
-                Tab.id == tab_id,
-                Tab.user_id == current_user.id)
-        )
-        tab = tab_query.scalar_one_or_none()
-
-        if not tab:
-            raise HTTPException(status_code=404, detail="Tab not found.")
-
-        await db.execute(delete(Message).filter(Message.tab_id == tab_id))
-        await db.execute(delete(Tab).filter(Tab.id == tab_id))
-        await db.commit()
-
-        return {"detail": "Tab deleted."}
+        return await TabService.delete_tab(db, current_user.id, tab_id)
     except Exception as e:
         logger.error(f"Error deleting tab: {str(e)}")
         raise HTTPException(
@@ -681,20 +756,7 @@ async def clear_context(
     try:
         current_user = await AuthService.get_current_user(request, db)
 
-        tab_query = await db.execute(
-            select(Tab).filter(
-                Tab.id == tab_id,
-                Tab.user_id == current_user.id)
-        )
-        tab = tab_query.scalar_one_or_none()
-
-        if not tab:
-            raise HTTPException(status_code=404, detail="Tab not found.")
-
-        await db.execute(delete(Message).filter(Message.tab_id == tab_id))
-        await db.commit()
-
-        return {"detail": "Context cleared."}
+        return await TabService.clear_context(db, current_user.id, tab_id)
     except Exception as e:
         logger.error(f"Error clearing context: {str(e)}")
         raise HTTPException(
@@ -709,35 +771,9 @@ async def clear_telegram_context(
     db: AsyncSession = Depends(get_db)
 ):
     try:
-        logger.info(f"Starting context deletion for user_id: {user_id}")
-
-        delete_query = delete(TelegramMessage).where(TelegramMessage.user_id == user_id)
-        logger.info(f"SQL delete query: {delete_query}")
-
-        result = await db.execute(delete_query)
-        await db.commit()
-
-        if result.rowcount == 0:
-            logger.info(f"Context not found for user_id: {user_id}")
-            return {"message": "Conversation context not found."}
-
-        logger.info(
-            f"Deleted records: {result.rowcount} for user_id: {user_id}"
-        )
-
-        remaining_messages = await db.execute(
-            select(TelegramMessage).where(TelegramMessage.user_id == user_id)
-        )
-        remaining_count = len(remaining_messages.scalars().all())
-        logger.info(
-            f"Remaining messages: {remaining_count} for user_id: {user_id}"
-        )
-
-        return {
-            "message": "Conversation context deleted.",
-            "deleted_records": result.rowcount,
-            "remaining_records": remaining_count
-        }
+        await ChatService.clear_telegram_context(db, user_id)
+        logger.info(f"Cleared Telegram context for user_id: {user_id}")
+        return {"message": "Conversation context deleted."}
 
     except Exception as e:
         logger.error(
@@ -0,0 +1,394 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional
+from urllib.parse import urlsplit
+
+import orjson
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from jose import JWTError
+from sqlalchemy.future import select
+
+from app.core.admission import admission_controller
+from app.core.config import settings
+from app.core.logging_config import log_body
+from app.core.metrics import metrics
+from app.core.resources import redis_client
+from app.core.status_codes import StatusMessages
+from app.db.init_db import AsyncSessionLocal
+from app.db.models import User
+from app.services.auth import AuthService
+from app.services.chat_service import ChatService
+from app.services.message_limit import MessageLimitService
+from app.services.tab_service import TabService
+from app.services.token_service import TokenService
+
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+open_connections = metrics.gauge(
+    "ws_connections",
+    "Open chat WebSocket connections"
+)
+slow_client_closes = metrics.counter(
+    "ws_slow_client_closes_total",
+    "Chat WebSocket connections closed because the client did not read"
+)
+
+# Close codes in the 4000-4999 range are reserved for applications.
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class Outbox:
+    # Bounded queue of outgoing messages. While they wait, consecutive
+    # deltas of the same answer are merged, so a slow reader gets fewer,
+    # larger frames instead of a growing queue. Other messages wait for
+    # room, which in turn stops the connection from reading new requests.
+
+    def __init__(self, size: int):
+        self.size = size
+        self.messages = deque()
+        self.changed = asyncio.Condition()
+
+    async def put(self, message: dict) -> None:
+        async with self.changed:
+            last = self.messages[-1] if self.messages else None
+            if (
+                message["type"] == "delta"
+                and last is not None
+                and last["type"] == "delta"
+                and last["id"] == message["id"]
+            ):
+                last["text"] += message["text"]
+                return
+            await self.changed.wait_for(
+                lambda: len(self.messages) < self.size
+            )
+            self.messages.append(message)
+            self.changed.notify_all()
+
+    async def get(self) -> dict:
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.messages)
+            message = self.messages.popleft()
+            self.changed.notify_all()
+            return message
+
+
+class ChatConnection:
+    def __init__(self, websocket: WebSocket, user_id: int, expires_at: float):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.outbox = Outbox(settings.WS_SEND_QUEUE_SIZE)
+        self.tasks = set()
+        self.closed = False
+        self.disconnected = asyncio.Event()
+        self.last_seen = time.monotonic()
+        self.handlers = {
+            "chat": self.chat,
+            "create_tab": self.create_tab,
+            "rename_tab": self.rename_tab,
+            "delete_tab": self.delete_tab,
+            "clear_context": self.clear_context,
+            "get_tab_messages": self.get_tab_messages,
+        }
+
+    async def run(self) -> None:
+        sender = asyncio.create_task(self._send_loop())
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        try:
+            await self._receive_loop()
+        finally:
+            self.closed = True
+            self.disconnected.set()
+            sender.cancel()
+            heartbeat.cancel()
+            # Answers still being generated are cancelled and their
+            # questions refunded, as for an HTTP client that went away.
+            await asyncio.gather(
+                sender, heartbeat, *self.tasks, return_exceptions=True
+            )
+
+    async def send(self, message: dict) -> None:
+        if self.closed:
+            return
+        try:
+            await asyncio.wait_for(
+                self.outbox.put(message), settings.WS_SEND_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            slow_client_closes.inc()
+            logger.warning(
+                f"Closing WebSocket of user {self.user_id}: client too slow"
+            )
+            await self.close(CLOSE_TRY_AGAIN_LATER, "Client too slow")
+
+    async def close(self, code: int, reason: str) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except RuntimeError:
+            pass
+
+    async def _receive_loop(self) -> None:
+        while True:
+            try:
+                raw = await self.websocket.receive_text()
+            except (WebSocketDisconnect, RuntimeError):
+                return
+            self.last_seen = time.monotonic()
+
+            try:
+                request = orjson.loads(raw)
+                kind = request["type"]
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                await self.send({
+                    "type": "error", "id": None,
+                    "status": 400, "detail": "Malformed message."
+                })
+                continue
+
+            if kind == "pong":
+                continue
+            if kind == "ping":
+                await self.send({"type": "pong"})
+                continue
+            if len(self.tasks) >= settings.WS_MAX_INFLIGHT:
+                await self.send({
+                    "type": "error", "id": request.get("id"),
+                    "status": 429, "detail": "Too many requests in progress."
+                })
+                continue
+
+            task = asyncio.create_task(self._dispatch(kind, request))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _send_loop(self) -> None:
+        while True:
+            message = await self.outbox.get()
+            try:
+                await self.websocket.send_text(orjson.dumps(message).decode())
+            except (WebSocketDisconnect, RuntimeError):
+                self.closed = True
+                return
+
+    async def _heartbeat_loop(self) -> None:
+        while not self.closed:
+            await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_seen > settings.WS_IDLE_TIMEOUT:
+                await self.close(1001, "Heartbeat timeout")
+                return
+            if time.time() >= self.expires_at:
+                await self.close(CLOSE_UNAUTHORIZED, "Session expired")
+                return
+            await self.send({"type": "ping"})
+
+    async def _dispatch(self, kind: str, request: dict) -> None:
+        request_id = request.get("id")
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise HTTPException(
+                    status_code=400, detail=f"Unknown message type: {kind}"
+                )
+            data = await handler(request_id, request)
+        except HTTPException as e:
+            error = {
+                "type": "error", "id": request_id,
+                "status": e.status_code, "detail": e.detail
+            }
+            retry_after = (e.headers or {}).get("Retry-After")
+            if retry_after is not None:
+                error["retry_after"] = int(retry_after)
+            await self.send(error)
+            return
+        except (KeyError, TypeError, ValueError):
+            await self.send({
+                "type": "error", "id": request_id,
+                "status": 400, "detail": "Invalid request."
+            })
+            return
+        except Exception as e:
+            logger.error(f"WebSocket {kind} failed: {str(e)}")
+            await self.send({
+                "type": "error", "id": request_id,
+                "status": 500, "detail": StatusMessages.SERVER_ERROR
+            })
+            return
+        await self.send({"type": "result", "id": request_id, "data": data})
+
+    async def push_balance(self, tokens_remaining: int) -> None:
+        await self.send({
+            "type": "balance", "tokens_remaining": tokens_remaining
+        })
+
+    async def chat(self, request_id, request: dict) -> dict:
+        # Goes through the same admission control as POST /chat, so load
+        # is shed across all connections, not only per connection.
+        if admission_controller.mode == "off":
+            return await self._chat(request_id, request)
+        if not await admission_controller.acquire():
+            raise HTTPException(
+                status_code=503,
+                detail=StatusMessages.UPSTREAM_BUSY,
+                headers={
+                    "Retry-After": str(admission_controller.retry_after())
+                }
+            )
+        started = time.monotonic()
+        latency = None
+        try:
+            result = await self._chat(request_id, request)
+            latency = time.monotonic() - started
+            return result
+        finally:
+            admission_controller.release(latency)
+
+    async def _chat(self, request_id, request: dict) -> dict:
+        text = request["message"]
+        tab_id = int(request["tab_id"])
+        logger.info(f"WebSocket chat in tab {tab_id}: {log_body(text)}")
+
+        async with AsyncSessionLocal() as db:
+            tab = await TabService.get_user_tab(db, self.user_id, tab_id)
+
+            if len(text) > 1000:
+                return {
+                    "response": "The maximum message length is 1000 characters.",
+                    "error": True
+                }
+
+            try:
+                await MessageLimitService.check_and_increment_question_count(
+                    redis_client, self.user_id
+                )
+            except HTTPException:
+                return {
+                    "response": StatusMessages.get_message_limit_text(
+                        settings.DAILY_MESSAGE_LIMIT
+                    ),
+                    "error": True
+                }
+
+            tokens_needed = TokenService.count_tokens(text)
+            if not await TokenService.deduct_tokens(
+                self.user_id, tokens_needed, db
+            ):
+                return {"response": "Insufficient tokens.", "error": True}
+
+            user = await db.get(User, self.user_id)
+            await self.push_balance(user.tokens)
+
+            async def on_delta(delta: str) -> None:
+                await self.send({
+                    "type": "delta", "id": request_id,
+                    "tab_id": tab_id, "text": delta
+                })
+
+            result = await ChatService.answer_in_tab(
+                db, user, tab, text, tokens_needed, on_delta=on_delta,
+                stop=self.disconnected.wait,
+                deadline=settings.CHAT_DEADLINE
+            )
+            if "tokens_remaining" in result:
+                await self.push_balance(result["tokens_remaining"])
+            return result
+
+    async def create_tab(self, request_id, request: dict) -> dict:
+        async with AsyncSessionLocal() as db:
+            return await TabService.create_tab(db, self.user_id)
+
+    async def rename_tab(self, request_id, request: dict) -> dict:
+        new_name = request["new_name"]
+        if not 1 <= len(new_name) <= 50:
+            raise HTTPException(
+                status_code=422,
+                detail="Tab name must be between 1 and 50 characters."
+            )
+        async with AsyncSessionLocal() as db:
+            return await TabService.rename_tab(
+                db, self.user_id, int(request["tab_id"]), new_name
+            )
+
+    async def delete_tab(self, request_id, request: dict) -> dict:
+        async with AsyncSessionLocal() as db:
+            return await TabService.delete_tab(
+                db, self.user_id, int(request["tab_id"])
+            )
+
+    async def clear_context(self, request_id, request: dict) -> dict:
+        async with AsyncSessionLocal() as db:
+            return await TabService.clear_context(
+                db, self.user_id, int(request["tab_id"])
+            )
+
+    async def get_tab_messages(self, request_id, request: dict) -> dict:
+        tab_id = int(request["tab_id"])
+        async with AsyncSessionLocal() as db:
+            await TabService.get_user_tab(db, self.user_id, tab_id)
+            return {
+                "tab_id": tab_id,
+                "messages": await TabService.tab_messages(db, tab_id)
+            }
+
+
+def _same_origin(websocket: WebSocket) -> bool:
+    # Browsers send cookies with cross-site WebSocket handshakes, so the
+    # Origin has to match the host the page was served from.
+    origin = websocket.headers.get("origin")
+    if origin is None:
+        return True
+    return urlsplit(origin).netloc == websocket.headers.get("host")
+
+
+async def _authenticate(websocket: WebSocket) -> Optional[tuple]:
+    token = (
+        websocket.cookies.get("access_token")
+        or websocket.headers.get("Authorization")
+    )
+    if not token:
+        return None
+    if token.lower().startswith("bearer "):
+        token = token.split()[1]
+    try:
+        payload = AuthService.decode_access_token(token)
+    except JWTError:
+        return None
+    if payload.get("sub") is None:
+        return None
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(User).filter(User.email == payload["sub"])
+        )
+        user = result.scalar_one_or_none()
+    if user is None:
+        return None
+    return user, payload.get("exp", float("inf"))
+
+
+@router.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    authenticated = None
+    if _same_origin(websocket):
+        authenticated = await _authenticate(websocket)
+    if authenticated is None:
+        await websocket.close(code=CLOSE_UNAUTHORIZED)
+        return
+    user, expires_at = authenticated
+
+    await websocket.accept()
+    connection = ChatConnection(websocket, user.id, expires_at)
+    open_connections.inc()
+    try:
+        await connection.push_balance(user.tokens)
+        await connection.run()
+    finally:
+        open_connections.inc(-1)
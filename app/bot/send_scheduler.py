@@ -0,0 +1,265 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+from enum import IntEnum
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from app.core.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+queue_latency = metrics.summary(
+    "bot_send_queue_latency_seconds",
+    "Time Bot API requests wait in the send queue"
+)
+sent_requests = metrics.counter(
+    "bot_send_requests_total",
+    "Bot API requests sent through the send scheduler"
+)
+retry_after_events = metrics.counter(
+    "bot_send_retry_after_total",
+    "RetryAfter (flood control) errors returned by Telegram"
+)
+queue_depth = metrics.gauge(
+    "bot_send_queue_depth",
+    "Bot API requests waiting in the send queue"
+)
+
+
+class SendPriority(IntEnum):
+    ANSWER = 0
+    NORMAL = 1
+    KEYBOARD = 2
+    CHAT_ACTION = 3
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _SendJob:
+    def __init__(self, chat_id, callback, args, kwargs):
+        self.chat_id = chat_id
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+# Bot API rate limiter for python-telegram-bot. Requests addressed to a
+# chat go through a priority queue and are dispatched only when both the
+# global and the per-chat token buckets allow it. A RetryAfter from
+# Telegram pauses all sending for the requested time and puts the request
+# back in the queue in its original position.
+class SendScheduler(BaseRateLimiter):
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: int,
+        max_retries: int,
+        metrics_log_interval: float = 60
+    ):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.metrics_log_interval = metrics_log_interval
+
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()
+        self._blocked_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight = set()
+
+    async def initialize(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatch())]
+        if self.metrics_log_interval:
+            self._tasks.append(asyncio.create_task(self._log_metrics()))
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for _, _, job in self._queue:
+            if not job.future.done():
+                job.future.cancel()
+        self._queue = []
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[dict],
+    ):
+        chat_id = data.get("chat_id")
+        if chat_id is None or self._wakeup is None:
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority")
+        if priority is None:
+            priority = (
+                SendPriority.CHAT_ACTION
+                if endpoint == "sendChatAction"
+                else SendPriority.NORMAL
+            )
+
+        job = _SendJob(chat_id, callback, args, kwargs)
+        self._push((int(priority), next(self._sequence), job))
+        return await job.future
+
+    def _push(self, entry: tuple) -> None:
+        heapq.heappush(self._queue, entry)
+        queue_depth.set(len(self._queue))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _next_ready(self, now: float):
+        skipped = []
+        wait = None
+        entry = None
+        while self._queue:
+            candidate = heapq.heappop(self._queue)
+            job = candidate[2]
+            if job.future.cancelled():
+                continue
+            delay = self._chat_bucket(job.chat_id).delay(now)
+            if delay == 0:
+                entry = candidate
+                break
+            skipped.append(candidate)
+            wait = delay if wait is None else min(wait, delay)
+        for candidate in skipped:
+            heapq.heappush(self._queue, candidate)
+        queue_depth.set(len(self._queue))
+        return entry, wait
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = max(
+                self._blocked_until - now,
+                self._global_bucket.delay(now)
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            entry, wait = self._next_ready(now)
+            if entry is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._global_bucket.consume(now)
+            self._chat_bucket(entry[2].chat_id).consume(now)
+            self._prune_chat_buckets(now)
+
+            task = asyncio.create_task(self._send(entry))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, entry: tuple) -> None:
+        priority, _, job = entry
+        if job.attempts == 0:
+            queue_latency.observe(
+                time.monotonic() - job.enqueued_at,
+                priority=SendPriority(priority).name.lower()
+            )
+        job.attempts += 1
+
+        try:
+            result = await job.callback(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            retry_after_events.inc()
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            self._blocked_until = max(
+                self._blocked_until, time.monotonic() + retry_after
+            )
+            logger.warning(
+                f"Flood control for chat {job.chat_id}: "
+                f"retrying in {retry_after} s (attempt {job.attempts})"
+            )
+            if job.attempts > self.max_retries:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            self._push(entry)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            sent_requests.inc(priority=SendPriority(priority).name.lower())
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def _prune_chat_buckets(self, now: float) -> None:
+        if len(self._chat_buckets) < 10000:
+            return
+        idle = [
+            chat_id for chat_id, bucket in self._chat_buckets.items()
+            if bucket.delay(now) == 0 and bucket.tokens >= bucket.capacity
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    async def _log_metrics(self) -> None:
+        while True:
+            await asyncio.sleep(self.metrics_log_interval)
+            logger.info(
+                "Send scheduler metrics: %s", metrics.snapshot("bot_send_")
+            )
@@ -1,4 +1,5 @@
 import asyncio
+import json
 import logging
 
 from aiohttp import ClientTimeout, ClientResponseError, ClientConnectionError
@@ -12,17 +13,13 @@ from telegram.ext import CallbackContext, filters
 from telegram.constants import ChatAction
 from telegram.error import NetworkError
 
+from app.bot.send_scheduler import SendPriority, SendScheduler
+from app.bot.update_processor import ChatOrderedUpdateProcessor
 from app.core.status_codes import StatusMessages
 from app.core.config import settings
-from app.db.models import TelegramMessage
-from sqlalchemy.future import select
-from app.db.init_db import AsyncSessionLocal
+from app.core.logging_config import log_body, setup_logging
 import re
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 telegram_token = settings.TELEGRAM_TOKEN
 api_url = settings.API_URL
@@ -36,6 +33,16 @@ if not api_url:
 user_sessions = {}
 
 
+def format_code_blocks(reply_message: str) -> str:
+    # Checking and formatting the response
+    if "```" in reply_message:
+        reply_message = re.sub(
+            r'```([a-zA-Z]*)\n',
+            r'```python\n', reply_message
+        )
+    return reply_message
+
+
 def get_main_menu_keyboard():
     keyboard = [
         [KeyboardButton("💰 Balance")],
@@ -122,7 +129,8 @@ async def start(update: Update, context: CallbackContext) -> None:
                 "Use the command "
                 "/tokenbalance to check your token balance. "
                 "/clear_context to clear the current dialogue context.",
-                reply_markup=get_main_menu_keyboard()
+                reply_markup=get_main_menu_keyboard(),
+                rate_limit_args={"priority": SendPriority.KEYBOARD}
             )
 
 
@@ -131,6 +139,31 @@ async def handle_api_error(update: Update, error_message: str):
     await update.message.reply_text(f"An error occurred: {error_message}")
 
 
+async def wait_for_job(session: ClientSession, headers: dict, events_url: str):
+    # Reads the job's server-sent events until the "result" event and
+    # returns its status code and body like a synchronous response.
+    async with session.get(
+        f"{api_url}{events_url}",
+        headers=headers,
+        timeout=ClientTimeout(total=settings.JOB_SSE_TIMEOUT + 10)
+    ) as response:
+        if response.status != 200:
+            return response.status, {}
+        event = None
+        async for raw_line in response.content:
+            line = raw_line.decode().rstrip("\r\n")
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:") and event == "result":
+                job = json.loads(line[len("data:"):].strip())
+                if not job:
+                    return 500, {}
+                return job.get("status_code", 500), job.get("result", {})
+            elif line.startswith("data:") and event == "timeout":
+                break
+    raise asyncio.TimeoutError("Timed out waiting for the job result")
+
+
 async def answer_question(update: Update, context: CallbackContext) -> None:
     chat_id = update.message.chat_id
 
@@ -159,52 +192,30 @@ async def answer_question(update: Update, context: CallbackContext) -> None:
         )
         return
 
-    logger.info(f"Received question from user_id {user_id}: {question_text}")
+    logger.info(
+        f"Received question from user_id {user_id}: {log_body(question_text)}"
+    )
 
     await context.bot.send_chat_action(
         chat_id=chat_id,
         action=ChatAction.TYPING
     )
 
-    async with AsyncSessionLocal() as db_session:
-        async with db_session.begin():
-            db_context = await db_session.execute(
-                select(TelegramMessage)
-                .filter(TelegramMessage.user_id == user_id)
-                .order_by(TelegramMessage.created_at.asc())
-                .limit(settings.MAX_CONTEXT_MESSAGES)
-            )
-            db_context = db_context.scalars().all()
-
-            full_context = [
-                {
-                    "role": msg.message["role"],
-                    "content": msg.message["content"]
-                }
-                for msg in db_context
-            ]
-            full_context.append({"role": "user", "content": question_text})
-
-            new_message = TelegramMessage(
-                user_id=user_id,
-                message={"role": "user", "content": question_text}
-            )
-            db_session.add(new_message)
-            await db_session.commit()
-
     async with ClientSession() as session:
         try:
             headers = {
-                "Authorization": f"Bearer {user_sessions[chat_id]['token']}"
+                "Authorization": f"Bearer {user_sessions[chat_id]['token']}",
+                # The same Telegram message, redelivered or retried, is
+                # answered and charged once.
+                "Idempotency-Key": (
+                    f"telegram:{chat_id}:{update.message.message_id}"
+                ),
             }
+            if settings.BOT_USE_JOBS:
+                headers["Prefer"] = "respond-async"
             logger.info(
-                "Sending request to /ask_telegram with data: %s",
-                {
-                    "user_id": user_id,
-                    "question": question_text,
-                    "context": full_context,
-                    "source": "telegram"
-                }
+                "Sending request to /ask_telegram for user_id %s: %s",
+                user_id, log_body(question_text)
             )
             async with session.post(
                 f"{api_url}/ask_telegram",
@@ -212,81 +223,82 @@ async def answer_question(update: Update, context: CallbackContext) -> None:
                 json={
                     "user_id": user_id,
                     "question": question_text,
-                    "context": full_context,
                     "source": "telegram"
                 },
                 timeout=ClientTimeout(total=60)
             ) as response:
-                if response.status == 200:
+                status = response.status
+                retry_after = response.headers.get("Retry-After", "")
+                data = {}
+                if response.content_type == "application/json":
                     data = await response.json()
-                    reply_message = data.get(
-                        'response',
-                        'No response from the server.'
-                    )
 
-                    # Checking and formatting the response
-                    if "```" in reply_message:
-                        reply_message = re.sub(
-                            r'```([a-zA-Z]*)\n',
-                            r'```python\n', reply_message
-                        )
+            if status == 202:
+                status, data = await wait_for_job(
+                    session, headers, data["events_url"]
+                )
 
-                    reply_message += (
-                        f"\n\nTokens used: {data.get('tokens_used', 0)}\n"
-                        f"Tokens remaining: {data.get('tokens_remaining', 0)}"
-                    )
-                    await update.message.reply_text(
-                        reply_message, parse_mode='Markdown'
-                    )
+            if status == 200:
+                reply_message = data.get(
+                    'response',
+                    'No response from the server.'
+                )
 
-                    assistant_message = TelegramMessage(
-                        user_id=user_id,
-                        message={"role": "assistant",
-                                 "content": data.get(
-                                     'response',
-                                     'No response from the server.'
-                                    )}
-                    )
-                    async with AsyncSessionLocal() as db_session:
-                        async with db_session.begin():
-                            db_session.add(assistant_message)
-                            await db_session.commit()
+                reply_message = format_code_blocks(reply_message)
 
-                elif response.status == 400:
-                    error_data = await response.json()
-                    await update.message.reply_text(
-                        error_data.get("detail", "Not enough tokens.")
-                    )
+                reply_message += (
+                    f"\n\nTokens used: {data.get('tokens_used', 0)}\n"
+                    f"Tokens remaining: {data.get('tokens_remaining', 0)}"
+                )
+                await update.message.reply_text(
+                    reply_message, parse_mode='Markdown',
+                    rate_limit_args={"priority": SendPriority.ANSWER}
+                )
 
-                elif response.status == 401:
-                    await update.message.reply_text(
-                        StatusMessages.SESSION_EXPIRED,
-                        reply_markup=get_main_menu_keyboard()
-                    )
-                    user_sessions.pop(chat_id, None)
-                elif response.status == 422:
-                    error_data = await response.json()
-                    logger.error(f"Validation error: {error_data}")
-                    await update.message.reply_text(
-                        StatusMessages.VALIDATION_ERROR
-                    )
-                elif response.status == 451:
-                    error_message = StatusMessages.get_message_limit_text(
-                        daily_message_limit
-                    )
-                    await update.message.reply_text(error_message)
-                elif response.status == 403:
-                    await update.message.reply_text(StatusMessages.FORBIDDEN)
-                elif response.status == 500:
-                    await update.message.reply_text(
-                        StatusMessages.SERVER_ERROR
-                    )
-                else:
-                    await update.message.reply_text(
-                        StatusMessages.UNEXPECTED_ERROR.format(
-                            status=response.status
-                        )
-                    )
+            elif status == 400:
+                await update.message.reply_text(
+                    data.get("detail", "Not enough tokens.")
+                )
+
+            elif status == 401:
+                await update.message.reply_text(
+                    StatusMessages.SESSION_EXPIRED,
+                    reply_markup=get_main_menu_keyboard()
+                )
+                user_sessions.pop(chat_id, None)
+            elif status == 422:
+                logger.error(f"Validation error: {data}")
+                await update.message.reply_text(
+                    StatusMessages.VALIDATION_ERROR
+                )
+            elif status == 451:
+                error_message = StatusMessages.get_message_limit_text(
+                    daily_message_limit
+                )
+                await update.message.reply_text(error_message)
+            elif status == 403:
+                await update.message.reply_text(StatusMessages.FORBIDDEN)
+            elif status == 500:
+                await update.message.reply_text(
+                    StatusMessages.SERVER_ERROR
+                )
+            elif status == 409:
+                await update.message.reply_text(
+                    StatusMessages.PREVIOUS_QUESTION_IN_PROGRESS
+                )
+            elif status == 503:
+                seconds = int(retry_after) if retry_after.isdigit() else 10
+                await update.message.reply_text(
+                    StatusMessages.SERVICE_BUSY.format(seconds=max(seconds, 1))
+                )
+            elif status == 504:
+                await update.message.reply_text(
+                    StatusMessages.ANSWER_TIMEOUT
+                )
+            else:
+                await update.message.reply_text(
+                    StatusMessages.UNEXPECTED_ERROR.format(status=status)
+                )
 
         except ClientResponseError as e:
             logger.error(f"API response error: {e.status} - {e.message}")
@@ -431,7 +443,26 @@ async def clear_context(update: Update, context: CallbackContext) -> None:
 
 
 def main() -> None:
-    application = ApplicationBuilder().token(telegram_token).build()
+    setup_logging()
+    application = (
+        ApplicationBuilder()
+        .token(telegram_token)
+        .rate_limiter(
+            SendScheduler(
+                global_rate=settings.BOT_SEND_GLOBAL_RATE,
+                chat_rate=settings.BOT_SEND_CHAT_RATE,
+                chat_burst=settings.BOT_SEND_CHAT_BURST,
+                max_retries=settings.BOT_SEND_MAX_RETRIES
+            )
+        )
+        .concurrent_updates(
+            ChatOrderedUpdateProcessor(
+                max_concurrent_updates=settings.BOT_CONCURRENT_UPDATES,
+                max_inflight_per_chat=settings.BOT_MAX_INFLIGHT_PER_CHAT
+            )
+        )
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("tokenbalance", get_token_balance))
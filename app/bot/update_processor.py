@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from typing import Awaitable, Dict
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+from app.core.status_codes import StatusMessages
+
+
+logger = logging.getLogger(__name__)
+
+
+# Updates of different chats run concurrently (up to
+# max_concurrent_updates), updates of one chat run one at a time in
+# arrival order. Once a chat has max_inflight_per_chat updates pending,
+# further ones get a short reply instead of being queued.
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int, max_inflight_per_chat: int):
+        super().__init__(max_concurrent_updates)
+        self.max_inflight_per_chat = max_inflight_per_chat
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_inflight: Dict[int, int] = {}
+
+    async def do_process_update(
+        self, update: object, coroutine: Awaitable
+    ) -> None:
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await coroutine
+            return
+
+        if self._chat_inflight.get(chat_id, 0) >= self.max_inflight_per_chat:
+            coroutine.close()
+            await self._reply_busy(update)
+            return
+
+        self._chat_inflight[chat_id] = self._chat_inflight.get(chat_id, 0) + 1
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            self._chat_inflight[chat_id] -= 1
+            if not self._chat_inflight[chat_id]:
+                del self._chat_inflight[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @staticmethod
+    def _chat_id(update: object):
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    @staticmethod
+    async def _reply_busy(update: Update) -> None:
+        if not update.effective_message:
+            return
+        try:
+            await update.effective_message.reply_text(
+                StatusMessages.PREVIOUS_QUESTION_IN_PROGRESS
+            )
+        except TelegramError as e:
+            logger.warning(f"Failed to send busy reply: {str(e)}")
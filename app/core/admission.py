@@ -0,0 +1,220 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Iterable, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.responses import ORJSONResponse
+from app.core.status_codes import StatusMessages
+
+
+admitted_requests = metrics.gauge(
+    "admission_in_flight",
+    "Requests admitted by admission control and not finished yet"
+)
+admission_limit = metrics.gauge(
+    "admission_limit",
+    "Current admission concurrency limit"
+)
+queued_requests = metrics.gauge(
+    "admission_queued",
+    "Requests waiting for admission"
+)
+shed_requests = metrics.counter(
+    "admission_rejected_total",
+    "Requests rejected with 503 by admission control, by reason"
+)
+
+MODES = ("off", "static", "gradient")
+# Gradient limit tuning: latency may rise this much over the long-term
+# average before the limit shrinks, the limit moves this fraction of the
+# way to its new value per sample, and the long-term average spans about
+# this many samples.
+TOLERANCE = 1.5
+SMOOTHING = 0.2
+SHORT_WINDOW = 10
+LONG_WINDOW = 500
+MAX_RETRY_AFTER = 30
+
+
+class AdmissionController:
+    # Limits how many requests run at once. Beyond the limit up to
+    # queue_size requests wait, each for at most queue_timeout seconds;
+    # everything else is rejected right away, before it touches the
+    # database or the upstream queue.
+    #
+    # In "gradient" mode the limit follows latency (as in Netflix's
+    # Gradient2): a short and a long moving average of request durations
+    # are compared, the limit shrinks in proportion while recent requests
+    # are slower than usual and grows by about sqrt(limit) while they are
+    # not and the limit is actually being used.
+
+    def __init__(
+        self,
+        mode: str,
+        min_limit: int,
+        max_limit: int,
+        queue_size: int,
+        queue_timeout: float
+    ):
+        if mode not in MODES:
+            raise ValueError(
+                f"Admission mode must be one of: {', '.join(MODES)}"
+            )
+        self.mode = mode
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._limit = float(max_limit)
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._short_latency = None
+        self._long_latency = None
+        admission_limit.set(max_limit)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def retry_after(self) -> int:
+        # About one recent request duration: by then slots have turned over.
+        latency = self._short_latency or 1
+        return min(max(1, math.ceil(latency)), MAX_RETRY_AFTER)
+
+    async def acquire(self) -> bool:
+        if self._in_flight < self.limit and not self._waiters:
+            self._start()
+            return True
+        if len(self._waiters) >= self.queue_size:
+            shed_requests.inc(reason="queue_full")
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        queued_requests.set(len(self._waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._abandon(future)
+                shed_requests.inc(reason="timeout")
+                return False
+        except asyncio.CancelledError:
+            # Granted in the meantime: give the slot to the next waiter.
+            if future.done() and not future.cancelled():
+                self.release(None)
+            else:
+                self._abandon(future)
+            raise
+        return True
+
+    def release(self, latency: Optional[float]) -> None:
+        self._in_flight -= 1
+        admitted_requests.set(self._in_flight)
+        if latency is not None:
+            self._update(latency)
+        self._dispatch()
+
+    def _abandon(self, future: asyncio.Future) -> None:
+        # The waiter leaves the queue right away: _dispatch() only pops
+        # waiters while slots are free, and dead ones would count against
+        # queue_size.
+        future.cancel()
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+        self._dispatch()
+
+    def _start(self) -> None:
+        self._in_flight += 1
+        admitted_requests.set(self._in_flight)
+
+    def _dispatch(self) -> None:
+        while self._waiters and self._in_flight < self.limit:
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._start()
+            future.set_result(None)
+        queued_requests.set(len(self._waiters))
+
+    def _update(self, latency: float) -> None:
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+            return
+        self._short_latency += (latency - self._short_latency) / SHORT_WINDOW
+        self._long_latency += (latency - self._long_latency) / LONG_WINDOW
+        # After a lasting slowdown the long average would keep shrinking
+        # the limit; let it catch up instead.
+        if self._long_latency / self._short_latency > 2:
+            self._long_latency *= 0.95
+        if self.mode != "gradient":
+            return
+
+        gradient = min(max(
+            TOLERANCE * self._long_latency / self._short_latency, 0.5
+        ), 1.0)
+        target = self._limit * gradient + math.sqrt(self._limit)
+        if target > self._limit and self._in_flight < self._limit / 2:
+            # The limit is not what holds requests back; do not raise it.
+            return
+        limit = self._limit * (1 - SMOOTHING) + target * SMOOTHING
+        self._limit = min(max(limit, self.min_limit), self.max_limit)
+        admission_limit.set(self.limit)
+        self._dispatch()
+
+
+class AdmissionMiddleware:
+    # Applies an AdmissionController to POST requests for the given paths
+    # and answers the rejected ones with 503 and Retry-After.
+
+    def __init__(
+        self, app, controller: AdmissionController, paths: Iterable[str]
+    ):
+        self.app = app
+        self.controller = controller
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or self.controller.mode == "off"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire():
+            response = ORJSONResponse(
+                status_code=503,
+                content={"detail": StatusMessages.UPSTREAM_BUSY},
+                headers={"Retry-After": str(self.controller.retry_after())}
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        latency = None
+        try:
+            await self.app(scope, receive, send)
+            latency = time.monotonic() - started
+        finally:
+            self.controller.release(latency)
+
+
+admission_controller = AdmissionController(
+    mode=settings.ADMISSION_MODE,
+    min_limit=settings.ADMISSION_MIN_CONCURRENCY,
+    max_limit=settings.ADMISSION_MAX_CONCURRENCY,
+    queue_size=settings.ADMISSION_QUEUE_SIZE,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT
+)
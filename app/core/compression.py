@@ -0,0 +1,116 @@
+import gzip
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.core.static_assets import accepts
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "text/",
+    "image/svg+xml",
+)
+
+# Bodies above this size are compressed in a worker thread so a large
+# export does not stall the event loop.
+THREAD_THRESHOLD = 256 * 1024
+
+
+class CompressionMiddleware:
+    # Negotiates brotli or gzip for complete (non-streaming) responses of
+    # at least minimum_size bytes. Streaming responses such as server-sent
+    # events and static files, responses that already carry a
+    # Content-Encoding, and range requests and partial or not-modified
+    # responses (whose body or headers describe the unencoded bytes) are
+    # passed through unchanged.
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = self._negotiate(request_headers)
+        if encoding is None or "range" in request_headers:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(scope=start)
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or start["status"] in (206, 304)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or not headers.get("content-type", "").startswith(
+                    COMPRESSIBLE_TYPES
+                )
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            body = await self._compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            if "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _negotiate(headers: Headers):
+        accept_encoding = headers.get("accept-encoding", "")
+        if brotli is not None and accepts(accept_encoding, "br"):
+            return "br"
+        if accepts(accept_encoding, "gzip"):
+            return "gzip"
+        return None
+
+    async def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            compress = brotli.compress
+            kwargs = {"quality": self.brotli_quality}
+        else:
+            compress = gzip.compress
+            kwargs = {"compresslevel": self.gzip_level}
+
+        if len(body) < THREAD_THRESHOLD:
+            return compress(body, **kwargs)
+        return await anyio.to_thread.run_sync(
+            lambda: compress(body, **kwargs)
+        )
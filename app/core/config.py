@@ -1,3 +1,5 @@
+from typing import Any, Dict, List
+
 from pydantic_settings import BaseSettings
 
 
@@ -12,6 +14,89 @@ class Settings(BaseSettings):
     TELEGRAM_BOT_URL: str
     MAX_CONTEXT_MESSAGES: int
 
+    DB_AUTO_MIGRATE: bool = False
+    DB_WARM_CONNECTIONS: int = 5
+    SHUTDOWN_DRAIN_TIMEOUT: float = 30
+
+    ADMISSION_MODE: str = "gradient"
+    ADMISSION_MIN_CONCURRENCY: int = 16
+    ADMISSION_MAX_CONCURRENCY: int = 256
+    ADMISSION_QUEUE_SIZE: int = 64
+    ADMISSION_QUEUE_TIMEOUT: float = 2
+
+    CHAT_DEADLINE: float = 120
+    TELEGRAM_DEADLINE: float = 55
+    IDEMPOTENCY_TTL: int = 86400
+
+    RESPONSE_COMPRESSION_MIN_SIZE: int = 1024
+    RESPONSE_GZIP_LEVEL: int = 6
+    RESPONSE_BROTLI_QUALITY: int = 4
+
+    BALANCE_CACHE_TTL: int = 86400
+    BALANCE_RECONCILE_INTERVAL: float = 300
+
+    PURGE_INTERVAL: float = 30
+    PURGE_BATCH_SIZE: int = 1000
+    PURGE_BATCH_PAUSE: float = 0.1
+    MESSAGE_RETENTION_DAYS: int = 0
+    TELEGRAM_MESSAGE_RETENTION_DAYS: int = 0
+
+    WS_HEARTBEAT_INTERVAL: float = 20
+    WS_IDLE_TIMEOUT: float = 60
+    WS_SEND_QUEUE_SIZE: int = 64
+    WS_SEND_TIMEOUT: float = 10
+    WS_MAX_INFLIGHT: int = 4
+
+    OPENAI_MODEL: str = "gpt-4o"
+    OPENAI_FALLBACK_MODEL: str = "gpt-4o-mini"
+    OPENAI_ROUTES: List[Dict[str, Any]] = []
+    OPENAI_HEDGE_QUANTILE: float = 0.95
+    OPENAI_HEDGE_MIN_DELAY: float = 1
+    OPENAI_HEDGE_MAX_DELAY: float = 8
+    OPENAI_HEDGE_MIN_SAMPLES: int = 20
+    OPENAI_DEFAULT_OUTPUT_RATE: float = 40
+    ANSWER_LATENCY_TARGETS: Dict[str, float] = {"free": 30, "pro": 90}
+
+    UPSTREAM_MAX_CONCURRENCY: int = 32
+    UPSTREAM_MIN_CONCURRENCY: int = 2
+    UPSTREAM_RATELIMIT_LOW_WATER: float = 0.05
+    UPSTREAM_RETRY_BASE_DELAY: float = 0.5
+    UPSTREAM_RETRY_BUDGET: float = 20
+    UPSTREAM_DRR_QUANTUM: int = 500
+    UPSTREAM_MAX_QUEUE_WAIT: float = 10
+    UPSTREAM_MAX_QUEUE_PER_USER: int = 4
+    UPSTREAM_PLAN_WEIGHTS: Dict[str, float] = {"free": 1, "pro": 4}
+
+    IMPORT_MAX_ROWS: int = 200000
+    IMPORT_MAX_BYTES: int = 100 * 1024 * 1024
+
+    JOB_MODE_ENABLED: bool = False
+    JOB_STREAM: str = "chat_jobs"
+    JOB_GROUP: str = "chat_workers"
+    JOB_STREAM_MAXLEN: int = 100000
+    JOB_RESULT_TTL: int = 3600
+    JOB_SSE_TIMEOUT: float = 120
+    JOB_WORKER_NAME: str = ""
+    JOB_WORKER_CONCURRENCY: int = 16
+    JOB_CLAIM_IDLE: float = 300
+    JOB_CALLBACK_URL_PREFIXES: List[str] = []
+
+    BOT_USE_JOBS: bool = False
+    BOT_CONCURRENT_UPDATES: int = 64
+    BOT_MAX_INFLIGHT_PER_CHAT: int = 2
+    BOT_SEND_GLOBAL_RATE: float = 30
+    BOT_SEND_CHAT_RATE: float = 1
+    BOT_SEND_CHAT_BURST: int = 3
+    BOT_SEND_MAX_RETRIES: int = 3
+
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+    LOG_SAMPLE_RATE: int = 20
+    LOG_MESSAGE_BODIES: str = "redact"
+    LOG_BODY_MAX_CHARS: int = 80
+
+    METRICS_TOKEN: str = ""
+
     class Config:
         env_file = "../.env"
 
@@ -0,0 +1,136 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from app.core.config import settings
+
+
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(
+                record.created, tz=timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        elif record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Passes at most `rate` records below WARNING per logger per second and
+# reports how many were dropped on the next record that gets through.
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+
+        second = int(record.created)
+        with self._lock:
+            window, count, dropped = self._windows.get(
+                record.name, (second, 0, 0)
+            )
+            if window != second:
+                window, count = second, 0
+            if count >= self.rate:
+                self._windows[record.name] = (window, count, dropped + 1)
+                return False
+            self._windows[record.name] = (window, count + 1, 0)
+
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    # Keeps the traceback apart from the message so the listener thread
+    # can put it into its own JSON field.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def log_body(text: str) -> str:
+    if text is None or settings.LOG_MESSAGE_BODIES == "full":
+        return text
+    if settings.LOG_MESSAGE_BODIES == "truncate":
+        if len(text) <= settings.LOG_BODY_MAX_CHARS:
+            return text
+        return (
+            f"{text[:settings.LOG_BODY_MAX_CHARS]}... [{len(text)} chars]"
+        )
+    return f"[redacted {len(text)} chars]"
+
+
+def setup_logging(level: str = None) -> QueueListener:
+    global _listener
+
+    if _listener is not None:
+        return _listener
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if settings.LOG_JSON:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        ))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter())
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level or settings.LOG_LEVEL)
+
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    _listener = QueueListener(
+        log_queue, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging() -> None:
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
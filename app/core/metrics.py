@@ -0,0 +1,167 @@
+import threading
+from collections import deque
+from typing import Dict, Tuple
+
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: dict = None) -> str:
+    pairs = list(key) + sorted((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {_format_labels(k) or "total": v
+                    for k, v in self._values.items()}
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+# Keeps the count and sum of all observations plus a window of the most
+# recent ones for quantiles, rendered as a Prometheus summary.
+class Summary:
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, name: str, description: str, window: int = 1024):
+        self.name = name
+        self.description = description
+        self.window = window
+        self._series: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0, 0.0, deque(maxlen=self.window)]
+                self._series[key] = series
+            series[0] += 1
+            series[1] += value
+            series[2].append(value)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(labels))
+        return series[0] if series else 0
+
+    def quantile(self, q: float, **labels) -> float:
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            samples = sorted(series[2]) if series else []
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self) -> dict:
+        result = {}
+        for key in list(self._series):
+            labels = dict(key)
+            count, total, _ = self._series[key]
+            result[_format_labels(key) or "total"] = {
+                "count": count,
+                "sum": round(total, 6),
+                **{
+                    f"p{int(q * 100)}": round(self.quantile(q, **labels), 6)
+                    for q in self.QUANTILES
+                },
+            }
+        return result
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} summary",
+        ]
+        for key in list(self._series):
+            labels = dict(key)
+            for q in self.QUANTILES:
+                lines.append(
+                    f"{self.name}{_format_labels(key, {'quantile': str(q)})} "
+                    f"{self.quantile(q, **labels)}"
+                )
+            count, total, _ = self._series[key]
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, description: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, description, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._get_or_create(Gauge, name, description)
+
+    def summary(self, name: str, description: str, **kwargs) -> Summary:
+        return self._get_or_create(Summary, name, description, **kwargs)
+
+    def snapshot(self, prefix: str = "") -> dict:
+        return {
+            name: metric.snapshot()
+            for name, metric in self._metrics.items()
+            if name.startswith(prefix)
+        }
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
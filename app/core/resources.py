@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+
+import aioredis
+from openai import AsyncOpenAI
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.db.init_db import engine
+
+
+logger = logging.getLogger(__name__)
+
+# One Redis pool per process, shared by the API, the services and the
+# job worker. Connections are opened lazily and warmed by warm_up().
+redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+
+_openai_client = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    global _openai_client
+
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY, max_retries=0
+        )
+    return _openai_client
+
+
+async def warm_up() -> None:
+    await redis_client.ping()
+
+    connections = [
+        await engine.connect() for _ in range(settings.DB_WARM_CONNECTIONS)
+    ]
+    try:
+        for connection in connections:
+            await connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            await connection.close()
+
+    get_openai_client()
+    logger.info("Redis, database and OpenAI clients are ready.")
+
+
+async def drain(in_flight, timeout: float) -> None:
+    # Waits for work that outlives its HTTP request (e.g. a hedged
+    # upstream call) to finish before the pools are closed.
+    deadline = time.monotonic() + timeout
+    while in_flight() and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if in_flight():
+        logger.warning(f"Shutting down with {in_flight()} calls in flight.")
+
+
+async def close() -> None:
+    global _openai_client
+
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+    await redis_client.close()
+    await engine.dispose()
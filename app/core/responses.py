@@ -0,0 +1,12 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    # JSON rendered with orjson. Kept here because FastAPI's class of the
+    # same name is deprecated and warns on every response.
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
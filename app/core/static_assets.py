@@ -0,0 +1,117 @@
+import json
+import os
+import stat
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
+DIST_DIRNAME = "dist"
+MANIFEST_NAME = "manifest.json"
+STATIC_URL = "/static"
+
+# Precompressed variants written by `python -m app.static_build`,
+# in order of preference.
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+IMAGE_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}
+TEXT_TYPES = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".svg": "image/svg+xml",
+    ".json": "application/json",
+}
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@lru_cache(maxsize=1)
+def load_manifest() -> Dict[str, str]:
+    path = os.path.join(STATIC_DIR, DIST_DIRNAME, MANIFEST_NAME)
+    try:
+        with open(path, encoding="utf-8") as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url(path: str) -> str:
+    # Fingerprinted URL when the build step has run, the plain file
+    # otherwise (local development).
+    fingerprinted = load_manifest().get(path)
+    if fingerprinted:
+        return f"{STATIC_URL}/{DIST_DIRNAME}/{fingerprinted}"
+    return f"{STATIC_URL}/{path}"
+
+
+def accepts(header: str, token: str) -> bool:
+    for item in header.lower().split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if name != token:
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+class AssetStaticFiles(StaticFiles):
+    async def get_response(self, path: str, scope) -> Response:
+        # Files under dist/ are fingerprinted and never change, so they are
+        # cached for a year and served from a precompressed (or WebP)
+        # variant when the client accepts it. Anything else is revalidated.
+        if path.split(os.sep, 1)[0] != DIST_DIRNAME:
+            response = await super().get_response(path, scope)
+            response.headers.setdefault("Cache-Control", "no-cache")
+            return response
+
+        headers = Headers(scope=scope)
+        variants, vary = self._variants(path, headers)
+        for suffix, encoding, media_type in variants:
+            full_path, stat_result = await anyio.to_thread.run_sync(
+                self.lookup_path, path + suffix
+            )
+            if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+                continue
+            response = self.file_response(full_path, stat_result, scope)
+            response.headers["Content-Type"] = media_type
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+            response.headers["Cache-Control"] = IMMUTABLE
+            if vary:
+                response.headers["Vary"] = vary
+            return response
+
+        response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = IMMUTABLE
+        if vary:
+            response.headers["Vary"] = vary
+        return response
+
+    @staticmethod
+    def _variants(path: str, headers: Headers) -> Tuple[List[tuple], str]:
+        extension = os.path.splitext(path)[1].lower()
+        if extension in IMAGE_TYPES:
+            if "image/webp" in headers.get("accept", ""):
+                return [(".webp", None, "image/webp")], "Accept"
+            return [], "Accept"
+        if extension in TEXT_TYPES:
+            accept_encoding = headers.get("accept-encoding", "")
+            return [
+                (suffix, encoding, TEXT_TYPES[extension])
+                for encoding, suffix in ENCODINGS
+                if accepts(accept_encoding, encoding)
+            ], "Accept-Encoding"
+        return [], ""
@@ -20,6 +20,22 @@ class StatusMessages:
     )
     UNEXPECTED_ERROR = "Unexpected error: HTTP {status}"
     UNAUTHORIZED = "Unauthorized"
+    UPSTREAM_BUSY = (
+        "Error 503: The service is busy right now. "
+        "Please try again in a few seconds."
+    )
+    SERVICE_BUSY = (
+        "The service is busy right now. "
+        "Please send your question again in {seconds} seconds."
+    )
+    ANSWER_TIMEOUT = (
+        "Error 504: The answer took too long and was cancelled. "
+        "The tokens for your question have been refunded."
+    )
+    PREVIOUS_QUESTION_IN_PROGRESS = (
+        "Still working on your previous question. "
+        "Please wait for the answer before sending a new one."
+    )
 
     @staticmethod
     def get_message_limit_text(limit):
@@ -0,0 +1,19 @@
+import asyncio
+import logging
+
+from app.core.logging_config import setup_logging
+from app.db.init_db import engine, init_db
+
+
+logger = logging.getLogger(__name__)
+
+
+async def main() -> None:
+    setup_logging()
+    await init_db()
+    await engine.dispose()
+    logger.info("Database schema is up to date.")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,12 +1,32 @@
 from datetime import datetime, timezone
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON
+from sqlalchemy import BigInteger, Column, Integer, String, Text, Date, DateTime
+from sqlalchemy import Enum, ForeignKey, JSON
+from sqlalchemy import Index, PrimaryKeyConstraint, text
 from sqlalchemy.orm import relationship
 
 
 Base = declarative_base()
 
+MESSAGE_ROLES = ("user", "assistant")
+message_role = Enum(*MESSAGE_ROLES, name="message_role")
+
+PURGE_PENDING_TABS = "deleted_at IS NOT NULL OR context_cleared_at IS NOT NULL"
+
+
+def legacy_document(role, body):
+    # The {"role", "content"} document the previous release reads from
+    # Message.content and TelegramMessage.message.
+    if body is None:
+        return None
+    return {"role": role, "content": body}
+
+
+def _legacy_document_default(context):
+    parameters = context.get_current_parameters()
+    return legacy_document(parameters.get("role"), parameters.get("body"))
+
 
 class User(Base):
     __tablename__ = "users"
@@ -18,9 +38,25 @@ class User(Base):
         default=lambda: datetime.now(timezone.utc)
     )
     tokens = Column(Integer, default=2000)
+    plan = Column(String, nullable=False, default="free", server_default="free")
+    # Incremented with every change of tokens; orders cache write-throughs.
+    balance_version = Column(
+        BigInteger, nullable=False, default=0, server_default="0"
+    )
+    # Telegram messages created up to this time are deleted; set when the
+    # context is cleared and reset once PurgeService has removed them.
+    telegram_context_cleared_at = Column(DateTime(timezone=True))
 
     tabs = relationship("Tab", back_populates="user")
 
+    __table_args__ = (
+        Index(
+            "ix_users_purge_pending", "id",
+            postgresql_where=text("telegram_context_cleared_at IS NOT NULL"),
+            sqlite_where=text("telegram_context_cleared_at IS NOT NULL")
+        ),
+    )
+
 
 class Tab(Base):
     __tablename__ = "tabs"
@@ -31,29 +67,99 @@ class Tab(Base):
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc)
     )
-    updated_at = Column(DateTime(timezone=True), onupdate=datetime.now)
+    updated_at = Column(
+        DateTime(timezone=True),
+        onupdate=lambda: datetime.now(timezone.utc)
+    )
+    # Maintained by TabService.record_messages() in the same transaction
+    # as the message inserts, so listing tabs never aggregates messages.
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime(timezone=True))
+    last_message_preview = Column(String)
+    # Tombstones: a deleted tab, or the messages of a cleared context, are
+    # hidden right away and removed in batches by PurgeService. Messages
+    # created up to context_cleared_at belong to the cleared context.
+    deleted_at = Column(DateTime(timezone=True))
+    context_cleared_at = Column(DateTime(timezone=True))
     user = relationship("User", back_populates="tabs")
     messages = relationship("Message", back_populates="tab")
 
+    __table_args__ = (
+        Index("ix_tabs_user_id_last_message_at", "user_id", "last_message_at"),
+        Index(
+            "ix_tabs_purge_pending", "id",
+            postgresql_where=text(PURGE_PENDING_TABS),
+            sqlite_where=text(PURGE_PENDING_TABS)
+        ),
+    )
+
 
 class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True, index=True)
     tab_id = Column(Integer, ForeignKey("tabs.id"), nullable=False)
-    content = Column(JSON)
+    # Copy of tab.user_id, so that search can use the (user_id,
+    # search_vector) index. In PostgreSQL a trigger fills it in for rows
+    # written without it by instances running the previous release.
+    user_id = Column(Integer, ForeignKey("users.id"))
+    # Legacy {"role", "content"} document. Still written from role and body
+    # for one release, so instances running the previous release can read
+    # new rows during the rollout; its rows are copied to role/body by
+    # backfill_message_columns(), which has to run again once the rollout
+    # is over.
+    content = Column(JSON, default=_legacy_document_default)
+    role = Column(message_role)
+    body = Column(Text)
+    token_count = Column(Integer)
+    # Model that produced an assistant message.
+    model = Column(String)
     created_at = Column(
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc)
     )
     tab = relationship("Tab", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_messages_tab_id_created_at", "tab_id", "created_at"),
+        Index("ix_messages_created_at", "created_at"),
+    )
+
 
 class TelegramMessage(Base):
     __tablename__ = 'telegram_messages'
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'))
-    message = Column(JSON)
+    # Legacy, see Message.content.
+    message = Column(JSON, default=_legacy_document_default)
+    role = Column(message_role)
+    body = Column(Text)
+    token_count = Column(Integer)
+    model = Column(String)
     created_at = Column(
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc)
     )
+
+    __table_args__ = (
+        Index(
+            "ix_telegram_messages_user_id_created_at", "user_id", "created_at"
+        ),
+        Index("ix_telegram_messages_created_at", "created_at"),
+    )
+
+
+class UsageDaily(Base):
+    # One row per user, UTC day, source ("web" or "telegram") and model,
+    # upserted by UsageService.record() when an answer is settled.
+    __tablename__ = "usage_daily"
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    source = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    requests = Column(Integer, nullable=False, default=0, server_default="0")
+    tokens_in = Column(BigInteger, nullable=False, default=0, server_default="0")
+    tokens_out = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "day", "source", "model"),
+    )
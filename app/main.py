@@ -1,34 +1,57 @@
+import asyncio
 import logging
-import aioredis
 import secrets
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 
 
 from app.db.init_db import init_db
+from app.core import resources
+from app.core.admission import AdmissionMiddleware, admission_controller
+from app.core.compression import CompressionMiddleware
 from app.core.config import settings
+from app.core.logging_config import setup_logging
+from app.core.static_assets import AssetStaticFiles
 from app.api.endpoints import router
+from app.api.websocket import router as websocket_router
+from app.services.balance_cache import BalanceCache
+from app.services.purge_service import PurgeService
+from app.services.upstream_scheduler import upstream_scheduler
 
 
-log_format = (
-    '%(asctime)s - '
-    '%(name)s - '
-    '%(levelname)s - '
-    '%(message)s'
-)
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format=log_format,
-    handlers=[logging.StreamHandler()]
-)
+setup_logging()
 
 logger = logging.getLogger(__name__)
 daily_message_limit = settings.DAILY_MESSAGE_LIMIT
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    if settings.DB_AUTO_MIGRATE:
+        await init_db()
+    await resources.warm_up()
+    reconciler = asyncio.create_task(BalanceCache.reconcile_forever())
+    purger = asyncio.create_task(PurgeService.purge_forever())
+    app.state.ready = True
+    logger.info("Application startup complete.")
+
+    yield
+
+    app.state.ready = False
+    reconciler.cancel()
+    purger.cancel()
+    await resources.drain(
+        lambda: upstream_scheduler.in_flight,
+        settings.SHUTDOWN_DRAIN_TIMEOUT
+    )
+    await resources.close()
+    logger.info("Application shutdown complete.")
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,17 +60,22 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.RESPONSE_COMPRESSION_MIN_SIZE,
+    gzip_level=settings.RESPONSE_GZIP_LEVEL,
+    brotli_quality=settings.RESPONSE_BROTLI_QUALITY
+)
+# Added last, so it runs first: rejected requests cost next to nothing.
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission_controller,
+    paths=("/chat", "/ask_telegram")
+)
 
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
-
-redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
-
-
-@app.on_event("startup")
-async def startup_event():
-    await init_db()
-    logger.info("Application startup complete.")
+app.mount(
+    "/static", AssetStaticFiles(directory="app/static"), name="static"
+)
 
 
 def generate_bot_token(user_id: int) -> str:
@@ -55,6 +83,7 @@ def generate_bot_token(user_id: int) -> str:
 
 
 app.include_router(router)
+app.include_router(websocket_router)
 
 
 if __name__ == '__main__':
@@ -5,7 +5,6 @@ from typing import Optional
 from fastapi import Depends, HTTPException, Request
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
@@ -18,8 +17,20 @@ class AuthService:
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES = 120
 
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+    _pwd_context = None
+
+    @classmethod
+    def pwd_context(cls):
+        # passlib and its bcrypt backend are only needed to register and
+        # log in, so they are loaded on first use instead of at startup.
+        if cls._pwd_context is None:
+            from passlib.context import CryptContext
+
+            cls._pwd_context = CryptContext(
+                schemes=["bcrypt"], deprecated="auto"
+            )
+        return cls._pwd_context
 
     @classmethod
     def create_access_token(
@@ -39,6 +50,31 @@ class AuthService:
         )
         return encoded_jwt
 
+    @classmethod
+    def decode_access_token(cls, token: str) -> dict:
+        return jwt.decode(
+            token,
+            cls.SECRET_KEY,
+            algorithms=[cls.ALGORITHM]
+        )
+
+    @classmethod
+    def get_current_user_id(cls, request: Request) -> Optional[int]:
+        # Reads the user id from the token without touching the database.
+        # Tokens issued before the "uid" claim existed return None.
+        token = (
+            request.cookies.get("access_token") or
+            request.headers.get("Authorization")
+        )
+        if not token:
+            return None
+        if token.lower().startswith("bearer "):
+            token = token.split()[1]
+        try:
+            return cls.decode_access_token(token).get("uid")
+        except JWTError:
+            return None
+
     @classmethod
     async def authenticate_user(
         cls,
@@ -48,7 +84,7 @@ class AuthService:
     ):
         result = await db.execute(select(User).filter(User.email == email))
         user = result.scalar_one_or_none()
-        if not user or not cls.pwd_context.verify(
+        if not user or not cls.pwd_context().verify(
             password,
             user.hashed_password
         ):
@@ -76,11 +112,7 @@ class AuthService:
                 if token.lower().startswith("bearer ")
                 else token
             )
-            payload = jwt.decode(
-                token,
-                cls.SECRET_KEY,
-                algorithms=[cls.ALGORITHM]
-            )
+            payload = cls.decode_access_token(token)
             email: str = payload.get("sub")
             if email is None:
                 raise credentials_exception
@@ -104,11 +136,7 @@ class AuthService:
             headers={"WWW-Authenticate": "Bearer"},
         )
         try:
-            payload = jwt.decode(
-                token,
-                cls.SECRET_KEY,
-                algorithms=[cls.ALGORITHM]
-            )
+            payload = cls.decode_access_token(token)
             email: str = payload.get("sub")
             if email is None:
                 raise credentials_exception
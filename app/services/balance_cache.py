@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.resources import redis_client
+from app.db.init_db import AsyncSessionLocal
+from app.db.models import User
+
+
+logger = logging.getLogger(__name__)
+
+cache_reads = metrics.counter(
+    "balance_cache_reads_total",
+    "Token balance reads, by result (hit or miss)"
+)
+cache_drift = metrics.counter(
+    "balance_cache_drift_total",
+    "Cached balances corrected by reconciliation"
+)
+
+# Writes only if the entry is not newer than the value being written, so
+# write-throughs that reach Redis out of order cannot roll the balance back.
+SET_IF_NEWER = """
+local current = redis.call('HGET', KEYS[1], 'version')
+if current and tonumber(current) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'tokens', ARGV[1], 'version', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+RECONCILE_LOCK = "balance-reconcile:lock"
+RECONCILE_BATCH = 500
+
+
+class BalanceCache:
+    # Redis holds the hot copy of users.tokens as {tokens, version}, where
+    # version is users.balance_version. Postgres stays the ledger: every
+    # change goes through TokenService, which writes the committed value
+    # through, and reconcile() repairs entries that drifted anyway.
+    _set_if_newer = None
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"balance:{user_id}"
+
+    @classmethod
+    async def set(cls, user_id: int, tokens: int, version: int) -> bool:
+        if cls._set_if_newer is None:
+            cls._set_if_newer = redis_client.register_script(SET_IF_NEWER)
+        try:
+            return bool(await cls._set_if_newer(
+                keys=[cls._key(user_id)],
+                args=[tokens, version, settings.BALANCE_CACHE_TTL]
+            ))
+        except Exception as e:
+            # The ledger is already committed; reconciliation or the TTL
+            # will bring the cache back in line.
+            logger.warning(f"Balance write-through failed: {str(e)}")
+            return False
+
+    @classmethod
+    async def get(cls, user_id: int, db: AsyncSession) -> Optional[int]:
+        try:
+            tokens = await redis_client.hget(cls._key(user_id), "tokens")
+        except Exception as e:
+            # Redis is only the hot copy: without it, read the ledger.
+            logger.warning(f"Balance cache read failed: {str(e)}")
+            tokens = None
+        if tokens is not None:
+            cache_reads.inc(result="hit")
+            return int(tokens)
+
+        cache_reads.inc(result="miss")
+        result = await db.execute(
+            select(User.tokens, User.balance_version)
+            .filter(User.id == user_id)
+        )
+        row = result.one_or_none()
+        if row is None:
+            return None
+        await cls.set(user_id, row.tokens, row.balance_version)
+        return row.tokens
+
+    @classmethod
+    async def reconcile(cls) -> int:
+        # Compares every cached balance with Postgres, in batches.
+        corrected = 0
+        batch = []
+        async for key in redis_client.scan_iter(
+            match="balance:*", count=RECONCILE_BATCH
+        ):
+            batch.append(int(key.split(":", 1)[1]))
+            if len(batch) >= RECONCILE_BATCH:
+                corrected += await cls._reconcile_batch(batch)
+                batch = []
+        if batch:
+            corrected += await cls._reconcile_batch(batch)
+        return corrected
+
+    @classmethod
+    async def _reconcile_batch(cls, user_ids: list) -> int:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(User.id, User.tokens, User.balance_version)
+                .filter(User.id.in_(user_ids))
+            )
+            rows = {row.id: row for row in result.all()}
+
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hget(cls._key(user_id), "tokens")
+        cached = await pipe.execute()
+
+        corrected = 0
+        for user_id, tokens in zip(user_ids, cached):
+            row = rows.get(user_id)
+            if row is None:
+                await redis_client.delete(cls._key(user_id))
+                continue
+            if tokens is None or int(tokens) == row.tokens:
+                continue
+            if await cls.set(user_id, row.tokens, row.balance_version):
+                corrected += 1
+                cache_drift.inc()
+        return corrected
+
+    @classmethod
+    async def reconcile_forever(cls) -> None:
+        # Every API process runs this loop; the lock lets one of them do
+        # the work per interval.
+        while True:
+            await asyncio.sleep(settings.BALANCE_RECONCILE_INTERVAL)
+            try:
+                acquired = await redis_client.set(
+                    RECONCILE_LOCK, "1", nx=True,
+                    ex=max(1, int(settings.BALANCE_RECONCILE_INTERVAL))
+                )
+                if not acquired:
+                    continue
+                corrected = await cls.reconcile()
+                if corrected:
+                    logger.warning(
+                        f"Corrected {corrected} cached token balances."
+                    )
+            except Exception as e:
+                logger.error(f"Balance reconciliation failed: {str(e)}")
@@ -0,0 +1,262 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.status_codes import StatusMessages
+from app.db.models import Message, Tab, TelegramMessage, User
+from app.services.openai_service import OpenAIService, OpenAIServiceTelegramBot
+from app.services.tab_service import TabService
+from app.services.token_service import TokenService
+from app.services.usage_service import UsageService
+
+
+abandoned_answers = metrics.counter(
+    "chat_abandoned_total",
+    "Answers cancelled before completion and refunded, by source and reason"
+)
+
+# nginx's code for a request the client closed; nobody reads the response.
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ChatService:
+    @staticmethod
+    async def _ask_until(
+        ask: Awaitable, stop: Optional[Callable[[], Awaitable]],
+        deadline: float
+    ) -> tuple:
+        # Runs the upstream call until it finishes, stop() completes (the
+        # client went away) or deadline seconds pass (0 means no limit).
+        # Cancelling the call releases its upstream slot and closes the
+        # streams. Returns (answer, None), or (None, reason) when the call
+        # was abandoned.
+        answer = asyncio.ensure_future(ask)
+        watcher = asyncio.ensure_future(stop()) if stop is not None else None
+        try:
+            done, _ = await asyncio.wait(
+                {answer} if watcher is None else {answer, watcher},
+                timeout=deadline or None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not answer.done():
+                answer.cancel()
+        if answer in done:
+            return answer.result(), None
+        try:
+            await answer
+        except BaseException:
+            pass
+        return None, "disconnect" if watcher in done else "deadline"
+
+    @staticmethod
+    async def _abandon(
+        db: AsyncSession, user: User, tokens_needed: int,
+        source: str, reason: str
+    ) -> None:
+        # The question was charged up front and nothing was delivered: the
+        # charge is given back, no usage is recorded, and the request ends
+        # with an error.
+        user_id = user.id
+        await db.rollback()
+        await TokenService.add_tokens(user_id, tokens_needed, db)
+        abandoned_answers.inc(source=source, reason=reason)
+        if reason == "disconnect":
+            raise HTTPException(
+                status_code=CLIENT_CLOSED_REQUEST,
+                detail="The client closed the request."
+            )
+        raise HTTPException(
+            status_code=504, detail=StatusMessages.ANSWER_TIMEOUT
+        )
+
+    @staticmethod
+    async def _recent_context(
+        db: AsyncSession, table, conditions: list
+    ) -> list:
+        # The last MAX_CONTEXT_MESSAGES messages, oldest first. Reads only
+        # the typed columns; rows still waiting for the backfill are
+        # skipped.
+        result = await db.execute(
+            select(table.role, table.body, table.token_count)
+            .filter(*conditions, table.body.is_not(None))
+            .order_by(table.created_at.desc(), table.id.desc())
+            .limit(settings.MAX_CONTEXT_MESSAGES)
+        )
+        return [
+            {"role": row.role, "content": row.body,
+             "token_count": row.token_count}
+            for row in reversed(result.all())
+        ]
+
+    @staticmethod
+    def visible_telegram_messages(user: User) -> list:
+        conditions = [TelegramMessage.user_id == user.id]
+        if user.telegram_context_cleared_at is not None:
+            conditions.append(
+                TelegramMessage.created_at > user.telegram_context_cleared_at
+            )
+        return conditions
+
+    @staticmethod
+    async def clear_telegram_context(db: AsyncSession, user_id: int) -> None:
+        # Hides the messages created until now; PurgeService deletes them
+        # in the background.
+        await db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(telegram_context_cleared_at=datetime.now(timezone.utc))
+        )
+        await db.commit()
+
+    @staticmethod
+    async def answer_in_tab(
+        db: AsyncSession,
+        user: User,
+        tab: Tab,
+        text: str,
+        tokens_needed: int,
+        on_delta: Callable[[str], Awaitable[None]] = None,
+        stop: Optional[Callable[[], Awaitable]] = None,
+        deadline: float = 0
+    ) -> dict:
+        # What is left after the question was charged; the answer is
+        # generated, and charged, within it.
+        balance = user.tokens
+        if balance <= 0:
+            await UsageService.record(db, user.id, "web", None, tokens_needed, 0)
+            await db.commit()
+            return {
+                "response": "Not enough tokens to get a response.",
+                "error": True
+            }
+
+        context = await ChatService._recent_context(
+            db, Message, TabService.visible_messages(tab)
+        )
+
+        answer, reason = await ChatService._ask_until(
+            OpenAIService.ask_question(
+                text, context, user=user, on_delta=on_delta, balance=balance
+            ),
+            stop, deadline
+        )
+        if answer is None:
+            await ChatService._abandon(db, user, tokens_needed, "web", reason)
+        response_text, updated_context, model = answer
+        tokens_used = min(TokenService.count_tokens(response_text), balance)
+        if not await TokenService.deduct_tokens(
+            user.id, tokens_used, db, commit=False
+        ):
+            # The question was charged; the answer was not delivered.
+            await UsageService.record(db, user.id, "web", model, tokens_needed, 0)
+            await db.commit()
+            return {
+                "response": "Not enough tokens to get a response.",
+                "error": True
+            }
+
+        # Both messages, the tab counters, the answer's charge and the usage
+        # rollup are committed together.
+        db.add_all([
+            Message(
+                tab_id=tab.id, user_id=user.id, role="user", body=text,
+                token_count=tokens_needed
+            ),
+            Message(
+                tab_id=tab.id, user_id=user.id, role="assistant",
+                body=response_text, token_count=tokens_used, model=model
+            ),
+        ])
+        await TabService.record_messages(db, tab.id, 2, response_text)
+        await UsageService.record(
+            db, user.id, "web", model, tokens_needed, tokens_used
+        )
+        await db.commit()
+        await TokenService.publish_balance(user)
+        await db.refresh(tab)
+
+        return {
+            "response": response_text,
+            "tokens_remaining": user.tokens,
+            "tab": TabService.tab_summary(tab)
+        }
+
+    @staticmethod
+    async def answer_in_telegram(
+        db: AsyncSession,
+        user: User,
+        question: str,
+        tokens_needed: int,
+        stop: Optional[Callable[[], Awaitable]] = None,
+        deadline: float = 0
+    ) -> dict:
+        balance = user.tokens
+        if balance <= 0:
+            await UsageService.record(
+                db, user.id, "telegram", None, tokens_needed, 0
+            )
+            await db.commit()
+            return {
+                "response": "Not enough tokens to receive the answer.",
+                "error": True
+            }
+
+        context = await ChatService._recent_context(
+            db, TelegramMessage, ChatService.visible_telegram_messages(user)
+        )
+
+        answer, reason = await ChatService._ask_until(
+            OpenAIServiceTelegramBot.ask_question(
+                question, context, user=user, balance=balance
+            ),
+            stop, deadline
+        )
+        if answer is None:
+            await ChatService._abandon(
+                db, user, tokens_needed, "telegram", reason
+            )
+        response_text, updated_context, model = answer
+        tokens_used = min(TokenService.count_tokens(response_text), balance)
+        if not await TokenService.deduct_tokens(
+            user.id, tokens_used, db, commit=False
+        ):
+            await UsageService.record(
+                db, user.id, "telegram", model, tokens_needed, 0
+            )
+            await db.commit()
+            return {
+                "response": "Not enough tokens to receive the answer.",
+                "error": True
+            }
+
+        db.add_all([
+            TelegramMessage(
+                user_id=user.id, role="user", body=question,
+                token_count=tokens_needed
+            ),
+            TelegramMessage(
+                user_id=user.id, role="assistant", body=response_text,
+                token_count=tokens_used, model=model
+            ),
+        ])
+        await UsageService.record(
+            db, user.id, "telegram", model, tokens_needed, tokens_used
+        )
+        await db.commit()
+        await TokenService.publish_balance(user)
+
+        return {
+            "response": response_text,
+            "tokens_used": tokens_needed + tokens_used,
+            "tokens_remaining": user.tokens
+        }
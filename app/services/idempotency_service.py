@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.responses import ORJSONResponse
+
+
+replayed_requests = metrics.counter(
+    "idempotency_replays_total",
+    "Requests answered from a stored result, by endpoint and whether the "
+    "duplicate had to wait for the first request"
+)
+
+MAX_KEY_LENGTH = 255
+# Added to the endpoint's deadline for the in-flight marker, so a request
+# that died without cleaning up blocks its key only briefly.
+PENDING_MARGIN = 30
+# Used as the deadline when the endpoint has none.
+DEFAULT_PENDING_TIME = 600
+
+
+class IdempotencyService:
+    # A request with an Idempotency-Key header runs once per user, endpoint
+    # and key. The first one writes a "pending" marker, runs and stores its
+    # response for IDEMPOTENCY_TTL seconds; duplicates get the stored
+    # response, waiting for it if the first one is still running. Requests
+    # that fail with an exception store nothing, so a retry runs again.
+    PENDING = "pending"
+    DONE = "done"
+
+    @staticmethod
+    def _key(user_id: int, scope: str, key: str) -> str:
+        return f"idempotency:{user_id}:{scope}:{key}"
+
+    @staticmethod
+    def _channel(redis_key: str) -> str:
+        return f"{redis_key}:done"
+
+    @staticmethod
+    def _fingerprint(payload: dict) -> str:
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    @staticmethod
+    def _replay(entry: dict) -> Response:
+        return ORJSONResponse(
+            status_code=entry["status_code"],
+            content=entry["body"],
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+    @classmethod
+    async def run(
+        cls,
+        redis_client,
+        request: Request,
+        user_id: int,
+        scope: str,
+        payload: dict,
+        handler: Callable[[], Awaitable],
+        deadline: float = 0
+    ):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return await handler()
+        if not 1 <= len(key) <= MAX_KEY_LENGTH or not key.isprintable():
+            raise HTTPException(
+                status_code=400, detail="Invalid Idempotency-Key."
+            )
+
+        redis_key = cls._key(user_id, scope, key)
+        fingerprint = cls._fingerprint(payload)
+        pending_time = (deadline or DEFAULT_PENDING_TIME) + PENDING_MARGIN
+        pending = json.dumps({"state": cls.PENDING, "fingerprint": fingerprint})
+
+        waited = False
+        pubsub = None
+        try:
+            loop = asyncio.get_running_loop()
+            give_up = loop.time() + pending_time
+            while True:
+                if await redis_client.set(
+                    redis_key, pending, nx=True, ex=int(pending_time)
+                ):
+                    break
+                raw = await redis_client.get(redis_key)
+                if raw is None:
+                    # The first request failed and released the key.
+                    continue
+                entry = json.loads(raw)
+                if entry["fingerprint"] != fingerprint:
+                    raise HTTPException(
+                        status_code=422,
+                        detail="This Idempotency-Key was already used for a "
+                        "different request."
+                    )
+                if entry["state"] == cls.DONE:
+                    replayed_requests.inc(
+                        endpoint=scope, waited=str(waited).lower()
+                    )
+                    return cls._replay(entry)
+                if loop.time() > give_up:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="A request with this Idempotency-Key is "
+                        "still in progress."
+                    )
+                if pubsub is None:
+                    # Subscribe, then check again: the result may have been
+                    # published in between.
+                    pubsub = redis_client.pubsub()
+                    await pubsub.subscribe(cls._channel(redis_key))
+                    continue
+                waited = True
+                await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1
+                )
+        finally:
+            if pubsub is not None:
+                await pubsub.unsubscribe(cls._channel(redis_key))
+                await pubsub.close()
+
+        try:
+            result = await handler()
+        except BaseException:
+            await redis_client.delete(redis_key)
+            await redis_client.publish(cls._channel(redis_key), "")
+            raise
+
+        if isinstance(result, JSONResponse):
+            status_code, body = result.status_code, json.loads(result.body)
+        else:
+            status_code, body = 200, result
+        await redis_client.set(
+            redis_key,
+            json.dumps({
+                "state": cls.DONE,
+                "fingerprint": fingerprint,
+                "status_code": status_code,
+                "body": body,
+            }, default=str),
+            ex=settings.IDEMPOTENCY_TTL
+        )
+        await redis_client.publish(cls._channel(redis_key), "")
+        return result
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import uuid
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, Request
+
+from app.core.config import settings
+
+
+class JobService:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    @staticmethod
+    def wants_async(request: Request) -> bool:
+        if not settings.JOB_MODE_ENABLED:
+            return False
+        prefer = request.headers.get("Prefer", "")
+        return (
+            "respond-async" in prefer
+            or request.query_params.get("mode") == "async"
+        )
+
+    @staticmethod
+    def check_callback_url(callback_url: Optional[str]) -> None:
+        if not callback_url:
+            return
+        allowed = tuple(settings.JOB_CALLBACK_URL_PREFIXES)
+        if not allowed or not callback_url.startswith(allowed):
+            raise HTTPException(
+                status_code=400, detail="Callback URL is not allowed."
+            )
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    @staticmethod
+    def _channel(job_id: str) -> str:
+        return f"job:{job_id}:done"
+
+    @classmethod
+    async def enqueue(cls, redis_client, kind: str, payload: dict) -> str:
+        callback_url = payload.pop("callback_url", None) or ""
+        job_id = uuid.uuid4().hex
+        await redis_client.hset(cls._key(job_id), mapping={
+            "status": cls.QUEUED,
+            "user_id": str(payload["user_id"]),
+        })
+        await redis_client.expire(cls._key(job_id), settings.JOB_RESULT_TTL)
+        await redis_client.xadd(
+            settings.JOB_STREAM,
+            {
+                "job_id": job_id,
+                "kind": kind,
+                "payload": json.dumps(payload),
+                "callback_url": callback_url,
+            },
+            maxlen=settings.JOB_STREAM_MAXLEN,
+            approximate=True
+        )
+        return job_id
+
+    @classmethod
+    def accepted(cls, job_id: str) -> dict:
+        return {
+            "job_id": job_id,
+            "status": cls.QUEUED,
+            "status_url": f"/jobs/{job_id}",
+            "events_url": f"/jobs/{job_id}/events",
+        }
+
+    @classmethod
+    async def get(cls, redis_client, job_id: str) -> Optional[dict]:
+        job = await redis_client.hgetall(cls._key(job_id))
+        if not job:
+            return None
+        result = {"job_id": job_id, "status": job["status"]}
+        if "result" in job:
+            result["status_code"] = int(job.get("status_code", 200))
+            result["result"] = json.loads(job["result"])
+        return result
+
+    @classmethod
+    async def set_running(cls, redis_client, job_id: str) -> None:
+        await redis_client.hset(cls._key(job_id), "status", cls.RUNNING)
+
+    @classmethod
+    async def set_result(
+        cls, redis_client, job_id: str, result: dict, status_code: int = 200
+    ) -> None:
+        await redis_client.hset(cls._key(job_id), mapping={
+            "status": cls.DONE if status_code < 400 else cls.FAILED,
+            "status_code": str(status_code),
+            "result": json.dumps(result),
+        })
+        await redis_client.expire(cls._key(job_id), settings.JOB_RESULT_TTL)
+        await redis_client.publish(cls._channel(job_id), job_id)
+
+    @classmethod
+    async def events(cls, redis_client, job_id: str) -> AsyncIterator[str]:
+        # Server-sent events: keepalive comments until the job finishes,
+        # then a single "result" event with the job document.
+        pubsub = redis_client.pubsub()
+        await pubsub.subscribe(cls._channel(job_id))
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.JOB_SSE_TIMEOUT
+            while True:
+                job = await cls.get(redis_client, job_id)
+                if job is None or job["status"] in (cls.DONE, cls.FAILED):
+                    yield f"event: result\ndata: {json.dumps(job)}\n\n"
+                    return
+                if loop.time() > deadline:
+                    yield "event: timeout\ndata: {}\n\n"
+                    return
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=15
+                )
+                if message is None:
+                    yield ": keepalive\n\n"
+        finally:
+            await pubsub.unsubscribe(cls._channel(job_id))
+            await pubsub.close()
@@ -0,0 +1,116 @@
+from typing import Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+route_decisions = metrics.counter(
+    "upstream_route_total",
+    "Model routing decisions, by model and matched rule"
+)
+first_token_latency = metrics.summary(
+    "upstream_first_token_seconds",
+    "Time to the first streamed token, by model"
+)
+hedged_requests = metrics.counter(
+    "upstream_hedges_total",
+    "Hedged requests sent to the fallback model, by primary model"
+)
+hedge_results = metrics.counter(
+    "upstream_hedge_results_total",
+    "Which request of a hedged pair produced the first token"
+)
+output_rate = metrics.summary(
+    "upstream_output_tokens_per_second",
+    "Streamed tokens per second after the first one, by model"
+)
+output_budgets = metrics.summary(
+    "upstream_max_tokens",
+    "max_tokens sent upstream, by plan"
+)
+
+# TokenService.count_tokens charges words + 10% of characters; an upstream
+# token is about 0.75 words and 4 characters, so about 1.15 charged tokens.
+CHARGED_PER_UPSTREAM_TOKEN = 1.15
+# Answers are never cut shorter than this by the latency target alone.
+MIN_LATENCY_BUDGET = 64
+
+
+class Route:
+    __slots__ = ("model", "fallback", "rule")
+
+    def __init__(self, model: str, fallback: Optional[str], rule: str):
+        self.model = model
+        self.fallback = fallback if fallback and fallback != model else None
+        self.rule = rule
+
+
+class ModelRouter:
+    @staticmethod
+    def route(prompt_tokens: int, context_messages: int, plan: str) -> Route:
+        # OPENAI_ROUTES is checked in order, e.g.
+        # [{"model": "gpt-4o-mini", "plans": ["free"], "max_prompt_tokens": 300}]
+        for index, rule in enumerate(settings.OPENAI_ROUTES):
+            if "plans" in rule and plan not in rule["plans"]:
+                continue
+            if prompt_tokens > rule.get("max_prompt_tokens", prompt_tokens):
+                continue
+            if prompt_tokens < rule.get("min_prompt_tokens", 0):
+                continue
+            if context_messages > rule.get(
+                "max_context_messages", context_messages
+            ):
+                continue
+            route = Route(
+                rule["model"],
+                rule.get("fallback", settings.OPENAI_FALLBACK_MODEL),
+                str(index)
+            )
+            break
+        else:
+            route = Route(
+                settings.OPENAI_MODEL,
+                settings.OPENAI_FALLBACK_MODEL,
+                "default"
+            )
+
+        route_decisions.inc(model=route.model, rule=route.rule)
+        return route
+
+    @staticmethod
+    def max_output_tokens(model: str, plan: str, balance: int) -> int:
+        # The answer may cost at most the balance left after the question,
+        # and should finish within the plan's latency target: the target,
+        # minus the p95 time to first token, at the model's median output
+        # rate. Until OPENAI_HEDGE_MIN_SAMPLES streams have been measured,
+        # OPENAI_DEFAULT_OUTPUT_RATE and OPENAI_HEDGE_MAX_DELAY stand in.
+        budget = int(balance / CHARGED_PER_UPSTREAM_TOKEN)
+
+        targets = settings.ANSWER_LATENCY_TARGETS
+        target = targets.get(plan, targets.get("free"))
+        if target:
+            samples = settings.OPENAI_HEDGE_MIN_SAMPLES
+            rate = settings.OPENAI_DEFAULT_OUTPUT_RATE
+            if output_rate.count(model=model) >= samples:
+                rate = output_rate.quantile(0.5, model=model)
+            first_token = settings.OPENAI_HEDGE_MAX_DELAY
+            if first_token_latency.count(model=model) >= samples:
+                first_token = first_token_latency.quantile(0.95, model=model)
+            budget = min(budget, max(
+                int((target - first_token) * rate), MIN_LATENCY_BUDGET
+            ))
+
+        output_budgets.observe(budget, plan=plan)
+        return budget
+
+    @staticmethod
+    def hedge_delay(model: str) -> float:
+        if first_token_latency.count(model=model) < settings.OPENAI_HEDGE_MIN_SAMPLES:
+            return settings.OPENAI_HEDGE_MAX_DELAY
+        delay = first_token_latency.quantile(
+            settings.OPENAI_HEDGE_QUANTILE, model=model
+        )
+        return min(
+            max(delay, settings.OPENAI_HEDGE_MIN_DELAY),
+            settings.OPENAI_HEDGE_MAX_DELAY
+        )
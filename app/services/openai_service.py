@@ -1,42 +1,71 @@
-import os
+import asyncio
 import logging
+import time
+from typing import Awaitable, Callable, Optional
 
-from openai import AsyncOpenAI, APIConnectionError, RateLimitError
+from openai import APIConnectionError, RateLimitError
 from openai import APIStatusError
 from fastapi import HTTPException
 
 from app.core.config import settings
+from app.core.resources import get_openai_client
+from app.db.models import User
+from app.services.model_router import (
+    ModelRouter,
+    Route,
+    first_token_latency,
+    hedge_results,
+    hedged_requests,
+    output_rate,
+)
+from app.services.token_service import TokenService
+from app.services.upstream_limiter import upstream_limiter
+from app.services.upstream_scheduler import upstream_scheduler
 
 
-class OpenAIService:
-    api_key = settings.OPENAI_API_KEY or os.getenv('OPENAI_API_KEY')
+# Streams shorter than this (in chunks, about one token each) say little
+# about the output rate.
+MIN_RATE_CHUNKS = 20
 
-    @classmethod
-    async def ask_question(cls, question: str, context: list = None):
-        try:
-            client = AsyncOpenAI(api_key=cls.api_key)
-            if context is None:
-                context = []
 
-            context = [
-                {"role": msg["role"], "content": msg["content"]}
-                for msg in context
-                if msg.get("role") is not None and msg.get("content") is not None
-            ]
+def build_context(question: str, context: list = None) -> list:
+    if context is None:
+        context = []
 
-            context = context[-settings.MAX_CONTEXT_MESSAGES:]
+    # token_count, when the caller has it stored, saves recounting.
+    context = [
+        {"role": msg["role"], "content": msg["content"],
+         "token_count": msg.get("token_count")}
+        for msg in context
+        if msg.get("role") is not None and msg.get("content") is not None
+    ]
 
-            context.append({"role": "user", "content": question})
+    context = context[-settings.MAX_CONTEXT_MESSAGES:]
 
-            chat_completion = await client.chat.completions.create(
-                messages=[{"role": msg["role"], "content": msg["content"]} for msg in context],
-                model="gpt-4o",
+    context.append({"role": "user", "content": question})
+    return context
+
+
+class OpenAIService:
+    @classmethod
+    async def ask_question(
+        cls, question: str, context: list = None, user: User = None,
+        on_delta: Callable[[str], Awaitable[None]] = None,
+        balance: Optional[int] = None
+    ):
+        try:
+            client = get_openai_client()
+            context = build_context(question, context)
+
+            response, model = await cls._create_completion(
+                client, context, user, on_delta, balance
             )
-            response = chat_completion.choices[0].message.content
 
             context.append({"role": "assistant", "content": response})
 
-            return response, context
+            return response, context, model
+        except HTTPException:
+            raise
         except APIConnectionError as e:
             logging.error(f"API connection error: {str(e)}")
             raise HTTPException(
@@ -64,59 +93,180 @@ class OpenAIService:
                 detail=f"Unexpected error: {str(e)}"
             )
 
+    @classmethod
+    async def _create_completion(
+        cls, client, context: list, user: User, on_delta=None,
+        balance: Optional[int] = None
+    ):
+        # With a balance, max_tokens is capped so the answer stays within
+        # it and within the plan's latency target.
+        messages = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in context
+        ]
+        user_key = user.id if user is not None else None
+        plan = user.plan if user is not None and user.plan else "free"
+        cost = sum(
+            TokenService.count_tokens(msg["content"])
+            if msg.get("token_count") is None else msg["token_count"]
+            for msg in context
+        )
+        route = ModelRouter.route(cost, len(context) - 1, plan)
+        max_tokens = None
+        if balance is not None:
+            max_tokens = max(
+                ModelRouter.max_output_tokens(route.model, plan, balance), 1
+            )
+
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            async with upstream_scheduler.slot(user_key, plan, cost):
+                try:
+                    return await cls._hedged_completion(
+                        client, messages, route, on_delta, max_tokens
+                    )
+                except RateLimitError as e:
+                    delay = None
+                    if e.code != "insufficient_quota":
+                        delay = upstream_limiter.on_throttled(
+                            e.response.headers, attempt, started
+                        )
+                    if delay is None:
+                        raise
 
-class OpenAIServiceTelegramBot:
-    api_key = settings.OPENAI_API_KEY or os.getenv('OPENAI_API_KEY')
+            attempt += 1
+            logging.warning(
+                f"Rate limit exceeded, retrying in {delay:.2f} s "
+                f"(attempt {attempt})"
+            )
+            await asyncio.sleep(delay)
 
     @classmethod
-    async def ask_question(cls, question: str, context: list = None):
+    async def _hedged_completion(
+        cls, client, messages: list, route: Route, on_delta=None,
+        max_tokens: Optional[int] = None
+    ):
+        # Streams from route.model. If no token has arrived after the
+        # model's hedge delay and there is a free upstream slot, the same
+        # request goes to route.fallback as well; the first stream to
+        # produce a token is used and the other one is cancelled, or closed
+        # if it produced a token too. Text is passed to on_delta as it
+        # arrives from the winning stream. Returns the text and the model
+        # that produced it.
+        started = {}
+        primary = asyncio.create_task(
+            cls._open_stream(client, route.model, messages, max_tokens)
+        )
+        started[primary] = route.model, time.monotonic()
+        tasks = [primary]
+        winner = None
         try:
-            client = AsyncOpenAI(api_key=cls.api_key)
-            if context is None:
-                context = []
+            if route.fallback:
+                done, _ = await asyncio.wait(
+                    {primary}, timeout=ModelRouter.hedge_delay(route.model)
+                )
+                if not done and upstream_scheduler.try_acquire():
+                    hedged_requests.inc(model=route.model)
+                    hedge = asyncio.create_task(
+                        cls._open_stream(
+                            client, route.fallback, messages, max_tokens
+                        )
+                    )
+                    hedge.add_done_callback(
+                        lambda _: upstream_scheduler.release()
+                    )
+                    started[hedge] = route.fallback, time.monotonic()
+                    tasks.append(hedge)
+            winner = await cls._first_successful(tasks)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    if winner is not None:
+                        # The loser's first token would have come later
+                        # than this; leaving it out would make the latency
+                        # look better than it is and hedge ever sooner.
+                        model, since = started[task]
+                        first_token_latency.observe(
+                            time.monotonic() - since, model=model
+                        )
+                elif (
+                    task is not winner and not task.cancelled()
+                    and task.exception() is None
+                ):
+                    await task.result()[0].close()
 
-            context = [
-                {"role": msg["role"], "content": msg["content"]}
-                for msg in context
-                if msg.get("role") is not None and msg.get("content") is not None
-            ]
+        model = route.model if winner is primary else route.fallback
+        if len(tasks) > 1:
+            hedge_results.inc(
+                winner="primary" if winner is primary else "fallback"
+            )
 
-            context = context[-settings.MAX_CONTEXT_MESSAGES:]
+        stream, chunks, first_text, headers = winner.result()
+        # Once per request: a hedged request is still one success.
+        upstream_limiter.on_success(headers)
+        parts = [first_text]
+        streaming_since = time.monotonic()
+        try:
+            if on_delta is not None and first_text:
+                await on_delta(first_text)
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    if on_delta is not None:
+                        await on_delta(chunk.choices[0].delta.content)
+        finally:
+            await stream.close()
+        elapsed = time.monotonic() - streaming_since
+        if len(parts) >= MIN_RATE_CHUNKS and elapsed > 0:
+            output_rate.observe((len(parts) - 1) / elapsed, model=model)
+        return "".join(parts), model
 
-            context.append({"role": "user", "content": question})
+    @staticmethod
+    async def _open_stream(
+        client, model: str, messages: list, max_tokens: Optional[int] = None
+    ):
+        started = time.monotonic()
+        options = {}
+        if max_tokens is not None:
+            options["max_tokens"] = max_tokens
+        raw_response = await client.chat.completions.with_raw_response.create(
+            messages=messages,
+            model=model,
+            stream=True,
+            **options
+        )
+        stream = raw_response.parse()
+        chunks = stream.__aiter__()
+        try:
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    first_token_latency.observe(
+                        time.monotonic() - started, model=model
+                    )
+                    return (
+                        stream, chunks, chunk.choices[0].delta.content,
+                        raw_response.headers
+                    )
+        except BaseException:
+            await stream.close()
+            raise
+        return stream, chunks, "", raw_response.headers
 
-            chat_completion = await client.chat.completions.create(
-                messages=[{"role": msg["role"], "content": msg["content"]} for msg in context],
-                model="gpt-4o",
+    @staticmethod
+    async def _first_successful(tasks: list) -> asyncio.Task:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
             )
-            response = chat_completion.choices[0].message.content
+            for task in tasks:
+                if task in done and task.exception() is None:
+                    return task
+        # Both failed: report the primary's error.
+        raise tasks[0].exception()
 
-            context.append({"role": "assistant", "content": response})
 
-            return response, context
-        except APIConnectionError as e:
-            logging.error(f"API connection error: {str(e)}")
-            raise HTTPException(
-                status_code=500,
-                detail="Unable to connect to the OpenAI API."
-            )
-        except RateLimitError as e:
-            logging.warning(f"Rate limit exceeded: {str(e)}")
-            raise HTTPException(
-                status_code=429,
-                detail="Rate limit exceeded."
-            )
-        except APIStatusError as e:
-            logging.error(
-                f"API returned an error: {e.status_code} - {e.response}"
-            )
-            raise HTTPException(
-                status_code=500,
-                detail="Error occurred when calling OpenAI API."
-            )
-        except Exception as e:
-            logging.error(f"Unexpected error: {str(e)}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Unexpected error: {str(e)}"
-            )
+class OpenAIServiceTelegramBot(OpenAIService):
+    pass
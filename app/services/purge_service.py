@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, delete, exists, update
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.resources import redis_client
+from app.db.init_db import AsyncSessionLocal
+from app.db.models import Message, Tab, TelegramMessage, User
+
+
+logger = logging.getLogger(__name__)
+
+purged_rows = metrics.counter(
+    "purge_deleted_rows_total",
+    "Rows removed by the background purge, by table and reason"
+)
+
+PURGE_LOCK = "purge:lock"
+# Renewed after every batch, so it only runs out if the holder dies.
+PURGE_LOCK_TTL = 60
+# Tombstoned tabs and users picked up per pass.
+PURGE_SCAN_LIMIT = 100
+
+
+class PurgeService:
+    # Deletes what requests only marked as deleted (tabs, cleared tab and
+    # Telegram contexts) and, when configured, messages older than the
+    # retention period. Rows go PURGE_BATCH_SIZE at a time, one short
+    # transaction each, with a pause after every batch at least as long as
+    # the batch took, so the purge never holds long locks and uses at most
+    # about half of one connection's time.
+
+    @staticmethod
+    async def _throttle(started: float) -> None:
+        await redis_client.expire(PURGE_LOCK, PURGE_LOCK_TTL)
+        await asyncio.sleep(
+            max(settings.PURGE_BATCH_PAUSE, time.monotonic() - started)
+        )
+
+    @classmethod
+    async def _delete_in_batches(cls, table, reason: str, *conditions) -> int:
+        total = 0
+        while True:
+            started = time.monotonic()
+            batch = (
+                select(table.id)
+                .filter(*conditions)
+                .limit(settings.PURGE_BATCH_SIZE)
+                .scalar_subquery()
+            )
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    delete(table)
+                    .where(table.id.in_(batch))
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            total += result.rowcount
+            purged_rows.inc(
+                result.rowcount, table=table.__tablename__, reason=reason
+            )
+            await cls._throttle(started)
+            if result.rowcount < settings.PURGE_BATCH_SIZE:
+                return total
+
+    @classmethod
+    async def purge_deleted_tabs(cls) -> int:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Tab.id)
+                .filter(Tab.deleted_at.is_not(None))
+                .limit(PURGE_SCAN_LIMIT)
+            )
+            tab_ids = result.scalars().all()
+
+        total = 0
+        for tab_id in tab_ids:
+            total += await cls._delete_in_batches(
+                Message, "deleted_tab", Message.tab_id == tab_id
+            )
+            # An answer that was still being written when the tab was
+            # deleted may have added messages; the tab then waits for the
+            # next pass.
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    delete(Tab)
+                    .where(
+                        Tab.id == tab_id,
+                        ~exists().where(Message.tab_id == tab_id)
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        return total
+
+    @classmethod
+    async def purge_cleared_contexts(cls) -> int:
+        async with AsyncSessionLocal() as db:
+            tabs = (await db.execute(
+                select(Tab.id, Tab.context_cleared_at)
+                .filter(
+                    Tab.context_cleared_at.is_not(None),
+                    Tab.deleted_at.is_(None)
+                )
+                .limit(PURGE_SCAN_LIMIT)
+            )).all()
+            users = (await db.execute(
+                select(User.id, User.telegram_context_cleared_at)
+                .filter(User.telegram_context_cleared_at.is_not(None))
+                .limit(PURGE_SCAN_LIMIT)
+            )).all()
+
+        total = 0
+        for tab_id, cleared_at in tabs:
+            total += await cls._delete_in_batches(
+                Message, "cleared_context",
+                Message.tab_id == tab_id, Message.created_at <= cleared_at
+            )
+            # Nothing is left behind the watermark, so it can go, unless
+            # the context was cleared again in the meantime.
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Tab)
+                    .where(Tab.id == tab_id, Tab.context_cleared_at == cleared_at)
+                    .values(context_cleared_at=None)
+                )
+                await db.commit()
+
+        for user_id, cleared_at in users:
+            total += await cls._delete_in_batches(
+                TelegramMessage, "cleared_context",
+                TelegramMessage.user_id == user_id,
+                TelegramMessage.created_at <= cleared_at
+            )
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(User)
+                    .where(
+                        User.id == user_id,
+                        User.telegram_context_cleared_at == cleared_at
+                    )
+                    .values(telegram_context_cleared_at=None)
+                )
+                await db.commit()
+        return total
+
+    @classmethod
+    async def _expire_messages(cls, cutoff: datetime) -> int:
+        # Like _delete_in_batches, but keeps the tab counters right: only
+        # messages still visible in their tab are subtracted.
+        total = 0
+        while True:
+            started = time.monotonic()
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(
+                        Message.id, Message.tab_id, Message.created_at,
+                        Tab.deleted_at, Tab.context_cleared_at
+                    )
+                    .join(Tab, Tab.id == Message.tab_id)
+                    .filter(Message.created_at < cutoff)
+                    .order_by(Message.created_at)
+                    .limit(settings.PURGE_BATCH_SIZE)
+                )).all()
+                if not rows:
+                    return total
+
+                visible = Counter(
+                    row.tab_id for row in rows
+                    if row.deleted_at is None and (
+                        row.context_cleared_at is None
+                        or row.created_at > row.context_cleared_at
+                    )
+                )
+                await db.execute(
+                    delete(Message)
+                    .where(Message.id.in_([row.id for row in rows]))
+                    .execution_options(synchronize_session=False)
+                )
+                for tab_id, count in visible.items():
+                    await db.execute(
+                        update(Tab)
+                        .where(Tab.id == tab_id)
+                        .values(message_count=case(
+                            (Tab.message_count > count,
+                             Tab.message_count - count),
+                            else_=0
+                        ))
+                    )
+                await db.commit()
+
+            total += len(rows)
+            purged_rows.inc(len(rows), table="messages", reason="retention")
+            await cls._throttle(started)
+            if len(rows) < settings.PURGE_BATCH_SIZE:
+                return total
+
+    @classmethod
+    async def apply_retention(cls) -> int:
+        now = datetime.now(timezone.utc)
+        total = 0
+        if settings.MESSAGE_RETENTION_DAYS > 0:
+            total += await cls._expire_messages(
+                now - timedelta(days=settings.MESSAGE_RETENTION_DAYS)
+            )
+        if settings.TELEGRAM_MESSAGE_RETENTION_DAYS > 0:
+            cutoff = now - timedelta(
+                days=settings.TELEGRAM_MESSAGE_RETENTION_DAYS
+            )
+            total += await cls._delete_in_batches(
+                TelegramMessage, "retention",
+                TelegramMessage.created_at < cutoff
+            )
+        return total
+
+    @classmethod
+    async def run_once(cls) -> int:
+        return (
+            await cls.purge_deleted_tabs()
+            + await cls.purge_cleared_contexts()
+            + await cls.apply_retention()
+        )
+
+    @classmethod
+    async def purge_forever(cls) -> None:
+        # Runs in every API process; the lock lets one of them purge at a
+        # time.
+        while True:
+            await asyncio.sleep(settings.PURGE_INTERVAL)
+            try:
+                acquired = await redis_client.set(
+                    PURGE_LOCK, "1", nx=True, ex=PURGE_LOCK_TTL
+                )
+                if not acquired:
+                    continue
+                try:
+                    purged = await cls.run_once()
+                finally:
+                    await redis_client.delete(PURGE_LOCK)
+                if purged:
+                    logger.info(f"Purged {purged} messages.")
+            except Exception as e:
+                logger.error(f"Purge failed: {str(e)}")
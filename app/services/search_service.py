@@ -0,0 +1,173 @@
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+SOURCES = ("all", "web", "telegram")
+MAX_QUERY_LENGTH = 200
+MAX_LIMIT = 50
+MAX_OFFSET = 1000
+
+# Uses the (user_id, search_vector) GIN indexes (SCHEMA_UPGRADES), so only
+# the user's own rows are read even for words found in most messages. The
+# web part also filters on t.user_id, which lets the planner go through the
+# user's tabs instead when they hold only a few messages.
+# Only the page being returned gets a ts_headline excerpt. Deleted tabs and
+# cleared contexts waiting for PurgeService are left out.
+POSTGRES_WEB = """
+    SELECT 'web' AS source, m.id, m.tab_id, m.role, m.body, m.created_at,
+           ts_rank_cd(m.search_vector, q.query) AS rank
+    FROM messages m JOIN tabs t ON t.id = m.tab_id, q
+    WHERE m.user_id = :user_id AND t.user_id = :user_id
+      AND m.search_vector @@ q.query
+      AND t.deleted_at IS NULL
+      AND (t.context_cleared_at IS NULL
+           OR m.created_at > t.context_cleared_at)
+"""
+POSTGRES_TELEGRAM = """
+    SELECT 'telegram' AS source, tm.id, NULL::integer AS tab_id,
+           tm.role, tm.body, tm.created_at,
+           ts_rank_cd(tm.search_vector, q.query) AS rank
+    FROM telegram_messages tm JOIN users u ON u.id = tm.user_id, q
+    WHERE tm.user_id = :user_id AND tm.search_vector @@ q.query
+      AND (u.telegram_context_cleared_at IS NULL
+           OR tm.created_at > u.telegram_context_cleared_at)
+"""
+POSTGRES_SEARCH = """
+WITH q AS (SELECT websearch_to_tsquery('simple', :query) AS query),
+hits AS ({hits})
+SELECT hits.source, hits.id, hits.tab_id, tabs.name AS tab_name,
+       hits.role::text AS role,
+       ts_headline('simple', hits.body, q.query,
+                   'MaxFragments=1, MaxWords=30, MinWords=10, '
+                   'StartSel="", StopSel=""') AS snippet,
+       hits.created_at, hits.rank
+FROM (
+    SELECT * FROM hits
+    ORDER BY rank DESC, created_at DESC, id DESC
+    LIMIT :limit OFFSET :offset
+) AS hits CROSS JOIN q LEFT JOIN tabs ON tabs.id = hits.tab_id
+ORDER BY hits.rank DESC, hits.created_at DESC, hits.id DESC
+"""
+
+# Local testing fallback over the FTS5 tables from SQLITE_SCHEMA.
+SQLITE_WEB = """
+    SELECT 'web' AS source, m.id AS id, m.tab_id, t.name AS tab_name,
+           m.role, snippet(messages_fts, 0, '', '', '…', 16) AS snippet,
+           m.created_at AS created_at, -bm25(messages_fts) AS rank
+    FROM messages_fts
+    JOIN messages m ON m.id = messages_fts.rowid
+    JOIN tabs t ON t.id = m.tab_id
+    WHERE messages_fts MATCH :query AND t.user_id = :user_id
+      AND t.deleted_at IS NULL
+      AND (t.context_cleared_at IS NULL
+           OR m.created_at > t.context_cleared_at)
+"""
+SQLITE_TELEGRAM = """
+    SELECT 'telegram' AS source, tm.id AS id, NULL AS tab_id,
+           NULL AS tab_name, tm.role,
+           snippet(telegram_messages_fts, 0, '', '', '…', 16) AS snippet,
+           tm.created_at AS created_at, -bm25(telegram_messages_fts) AS rank
+    FROM telegram_messages_fts
+    JOIN telegram_messages tm ON tm.id = telegram_messages_fts.rowid
+    JOIN users u ON u.id = tm.user_id
+    WHERE telegram_messages_fts MATCH :query AND tm.user_id = :user_id
+      AND (u.telegram_context_cleared_at IS NULL
+           OR tm.created_at > u.telegram_context_cleared_at)
+"""
+SQLITE_SEARCH = """
+{hits}
+ORDER BY rank DESC, created_at DESC, id DESC
+LIMIT :limit OFFSET :offset
+"""
+
+
+class SearchService:
+    @staticmethod
+    def _fts5_query(query: str) -> str:
+        # Every word as a quoted FTS5 string, so user input cannot use the
+        # query syntax; the words are combined with AND.
+        return " ".join(
+            '"' + word.replace('"', '""') + '"' for word in query.split()
+        )
+
+    @classmethod
+    async def search(
+        cls,
+        db: AsyncSession,
+        user_id: int,
+        query: str,
+        source: str = "all",
+        limit: int = 20,
+        offset: int = 0
+    ) -> dict:
+        query = query.strip()
+        if not 1 <= len(query) <= MAX_QUERY_LENGTH:
+            raise HTTPException(
+                status_code=422,
+                detail=f"The query must be 1 to {MAX_QUERY_LENGTH} characters."
+            )
+        if source not in SOURCES:
+            raise HTTPException(
+                status_code=422,
+                detail=f"source must be one of: {', '.join(SOURCES)}."
+            )
+        if not 1 <= limit <= MAX_LIMIT or not 0 <= offset <= MAX_OFFSET:
+            raise HTTPException(
+                status_code=422,
+                detail=f"limit must be 1 to {MAX_LIMIT} "
+                f"and offset 0 to {MAX_OFFSET}."
+            )
+
+        if db.bind.dialect.name == "postgresql":
+            web, telegram, template = (
+                POSTGRES_WEB, POSTGRES_TELEGRAM, POSTGRES_SEARCH
+            )
+            match = query
+        else:
+            web, telegram, template = (
+                SQLITE_WEB, SQLITE_TELEGRAM, SQLITE_SEARCH
+            )
+            match = cls._fts5_query(query)
+        parts = []
+        if source in ("all", "web"):
+            parts.append(web)
+        if source in ("all", "telegram"):
+            parts.append(telegram)
+
+        result = await db.execute(
+            text(template.format(hits=" UNION ALL ".join(parts))),
+            {
+                "query": match,
+                "user_id": user_id,
+                "limit": limit,
+                "offset": offset,
+            }
+        )
+        rows = result.mappings().all()
+
+        return {
+            "query": query,
+            "source": source,
+            "limit": limit,
+            "offset": offset,
+            "results": [
+                {
+                    "source": row["source"],
+                    "message_id": row["id"],
+                    "tab_id": row["tab_id"],
+                    "tab_name": row["tab_name"],
+                    "role": row["role"],
+                    "snippet": row["snippet"],
+                    "created_at": (
+                        row["created_at"].isoformat()
+                        if isinstance(row["created_at"], datetime)
+                        else row["created_at"]
+                    ),
+                    "rank": float(row["rank"]),
+                }
+                for row in rows
+            ],
+        }
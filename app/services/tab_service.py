@@ -0,0 +1,178 @@
+from datetime import datetime, timezone
+
+from fastapi import HTTPException
+from sqlalchemy import func, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.db.models import Message, Tab
+
+
+PREVIEW_LENGTH = 100
+
+
+class TabService:
+    @staticmethod
+    async def get_user_tab(db: AsyncSession, user_id: int, tab_id: int) -> Tab:
+        tab_query = await db.execute(
+            select(Tab).filter(
+                Tab.id == tab_id, Tab.user_id == user_id,
+                Tab.deleted_at.is_(None)
+            )
+        )
+        tab = tab_query.scalar_one_or_none()
+        if tab is None:
+            raise HTTPException(status_code=404, detail="Tab not found.")
+        return tab
+
+    @staticmethod
+    async def create_tab(db: AsyncSession, user_id: int) -> dict:
+        new_tab = Tab(user_id=user_id, name="New Tab")
+        db.add(new_tab)
+        await db.commit()
+        await db.refresh(new_tab)
+        return {"tab_id": new_tab.id, "name": new_tab.name}
+
+    @classmethod
+    async def rename_tab(
+        cls, db: AsyncSession, user_id: int, tab_id: int, new_name: str
+    ) -> dict:
+        tab = await cls.get_user_tab(db, user_id, tab_id)
+        tab.name = new_name
+        await db.commit()
+        return {"tab_id": tab.id, "new_name": tab.name}
+
+    @classmethod
+    async def delete_tab(
+        cls, db: AsyncSession, user_id: int, tab_id: int
+    ) -> dict:
+        # Only marks the tab; PurgeService deletes its messages and the
+        # tab itself in the background.
+        await cls.get_user_tab(db, user_id, tab_id)
+        await db.execute(
+            update(Tab)
+            .where(Tab.id == tab_id)
+            .values(deleted_at=datetime.now(timezone.utc))
+        )
+        await db.commit()
+        return {"detail": "Tab deleted."}
+
+    @classmethod
+    async def clear_context(
+        cls, db: AsyncSession, user_id: int, tab_id: int
+    ) -> dict:
+        # Messages created until now are hidden by the watermark and purged
+        # in the background.
+        await cls.get_user_tab(db, user_id, tab_id)
+        await db.execute(
+            update(Tab)
+            .where(Tab.id == tab_id)
+            .values(
+                context_cleared_at=datetime.now(timezone.utc),
+                message_count=0,
+                last_message_at=None,
+                last_message_preview=None
+            )
+        )
+        await db.commit()
+        return {"detail": "Context cleared."}
+
+    @staticmethod
+    def visible_messages(tab: Tab) -> list:
+        # Conditions selecting the messages of a loaded tab that have not
+        # been cleared.
+        conditions = [Message.tab_id == tab.id]
+        if tab.context_cleared_at is not None:
+            conditions.append(Message.created_at > tab.context_cleared_at)
+        return conditions
+
+    @staticmethod
+    async def record_messages(
+        db: AsyncSession, tab_id: int, count: int, last_text: str
+    ) -> None:
+        # Does not commit: callers add the messages and commit both
+        # together. The increment is done in SQL so concurrent answers in
+        # the same tab do not lose updates.
+        await db.execute(
+            update(Tab)
+            .where(Tab.id == tab_id)
+            .values(
+                message_count=Tab.message_count + count,
+                last_message_at=datetime.now(timezone.utc),
+                last_message_preview=last_text[:PREVIEW_LENGTH]
+            )
+        )
+
+    @staticmethod
+    async def refresh_counters(db: AsyncSession, tab_ids: list) -> None:
+        # Recomputes the counters from the messages, for tabs filled in
+        # bulk (imports). Does not commit.
+        if not tab_ids:
+            return
+        messages = select(Message).filter(Message.tab_id == Tab.id)
+        last_message = (
+            messages.order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(1)
+        )
+        await db.execute(
+            update(Tab)
+            .where(Tab.id.in_(tab_ids))
+            .values(
+                message_count=messages.with_only_columns(
+                    func.count()
+                ).scalar_subquery(),
+                last_message_at=last_message.with_only_columns(
+                    Message.created_at
+                ).scalar_subquery(),
+                last_message_preview=last_message.with_only_columns(
+                    func.substr(Message.body, 1, PREVIEW_LENGTH)
+                ).scalar_subquery()
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def tab_summary(tab: Tab) -> dict:
+        return {
+            "id": tab.id,
+            "name": tab.name,
+            "created_at": tab.created_at.isoformat(),
+            "updated_at": tab.updated_at.isoformat() if tab.updated_at else None,
+            "message_count": tab.message_count or 0,
+            "last_message_at": (
+                tab.last_message_at.isoformat() if tab.last_message_at else None
+            ),
+            "last_message_preview": tab.last_message_preview,
+        }
+
+    @staticmethod
+    async def list_tabs(db: AsyncSession, user_id: int) -> list:
+        # Uses ix_tabs_user_id_last_message_at; most recently active first,
+        # tabs without messages last.
+        tabs_query = await db.execute(
+            select(Tab)
+            .filter(Tab.user_id == user_id, Tab.deleted_at.is_(None))
+            .order_by(Tab.last_message_at.desc().nullslast(), Tab.id.desc())
+        )
+        return tabs_query.scalars().all()
+
+    @staticmethod
+    async def tab_messages(db: AsyncSession, tab_id: int) -> list:
+        messages_query = await db.execute(
+            select(Message.role, Message.body)
+            .join(Tab, Tab.id == Message.tab_id)
+            .filter(
+                Message.tab_id == tab_id,
+                Message.body.is_not(None),
+                Tab.deleted_at.is_(None),
+                or_(
+                    Tab.context_cleared_at.is_(None),
+                    Message.created_at > Tab.context_cleared_at
+                )
+            )
+            .order_by(Message.created_at.asc(), Message.id.asc())
+        )
+        return [
+            {"sender": row.role, "text": row.body}
+            for row in messages_query.all()
+        ]
@@ -1,6 +1,10 @@
+from typing import Optional
+
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.models import User
+from app.services.balance_cache import BalanceCache
 
 
 class TokenService:
@@ -13,13 +17,55 @@ class TokenService:
         return tokens
 
     @staticmethod
+    async def _apply(
+        user_id: int, change: int, db: AsyncSession, commit: bool,
+        minimum: Optional[int] = None
+    ) -> Optional[int]:
+        # Every balance change is one atomic UPDATE that also bumps
+        # balance_version; the committed result is written through to
+        # the cache. With commit=False the caller commits and then calls
+        # publish_balance().
+        statement = (
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                tokens=User.tokens + change,
+                balance_version=User.balance_version + 1
+            )
+            .returning(User.tokens, User.balance_version)
+            .execution_options(synchronize_session="fetch")
+        )
+        if minimum is not None:
+            statement = statement.where(User.tokens >= minimum)
+        row = (await db.execute(statement)).one_or_none()
+        if row is None:
+            return None
+        if commit:
+            await db.commit()
+            await BalanceCache.set(user_id, row.tokens, row.balance_version)
+        return row.tokens
+
+    @classmethod
     async def deduct_tokens(
+        cls,
         user_id: int,
-        tokens: int, db: AsyncSession
+        tokens: int, db: AsyncSession,
+        commit: bool = True
     ) -> bool:
-        user = await db.get(User, user_id)
-        if user and user.tokens >= tokens:
-            user.tokens -= tokens
-            await db.commit()
-            return True
-        return False
+        remaining = await cls._apply(
+            user_id, -tokens, db, commit, minimum=tokens
+        )
+        return remaining is not None
+
+    @classmethod
+    async def add_tokens(
+        cls,
+        user_id: int,
+        tokens: int, db: AsyncSession,
+        commit: bool = True
+    ) -> Optional[int]:
+        return await cls._apply(user_id, tokens, db, commit)
+
+    @staticmethod
+    async def publish_balance(user: User) -> None:
+        await BalanceCache.set(user.id, user.tokens, user.balance_version)
@@ -0,0 +1,280 @@
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+import orjson
+from fastapi import HTTPException
+from sqlalchemy import insert, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.db.init_db import AsyncSessionLocal
+from app.db.models import MESSAGE_ROLES, Message, Tab, TelegramMessage
+from app.db.models import User, legacy_document
+from app.services.tab_service import TabService
+
+
+FORMAT_VERSION = 1
+# Rows fetched per round trip from the server-side cursor, and rows per
+# COPY or multi-row INSERT when importing.
+EXPORT_BATCH_SIZE = 1000
+IMPORT_BATCH_SIZE = 5000
+# Compressed bytes collected before a chunk is handed to the response.
+CHUNK_SIZE = 64 * 1024
+# Bounds the memory one import line, or one step of decompression, can use.
+MAX_LINE_LENGTH = 1024 * 1024
+
+
+class TransferService:
+    # A user's history as gzip-compressed NDJSON: an "export" header line,
+    # then one line per tab, per tab message and per Telegram message.
+    # Both directions stream, so memory does not grow with the history.
+
+    @staticmethod
+    async def _export_lines(db: AsyncSession, user_id: int):
+        yield {
+            "type": "export",
+            "version": FORMAT_VERSION,
+            "exported_at": datetime.now(timezone.utc),
+        }
+
+        tabs = await db.stream(
+            select(Tab.id, Tab.name, Tab.created_at)
+            .filter(Tab.user_id == user_id, Tab.deleted_at.is_(None))
+            .order_by(Tab.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for row in tabs:
+            yield {
+                "type": "tab", "id": row.id,
+                "name": row.name, "created_at": row.created_at,
+            }
+
+        queries = (
+            ("message", select(Message.tab_id, Message.role, Message.body,
+                               Message.token_count, Message.model,
+                               Message.created_at)
+             .join(Tab, Tab.id == Message.tab_id)
+             .filter(Tab.user_id == user_id, Message.body.is_not(None),
+                     Tab.deleted_at.is_(None),
+                     or_(Tab.context_cleared_at.is_(None),
+                         Message.created_at > Tab.context_cleared_at))
+             .order_by(Message.tab_id, Message.created_at, Message.id)),
+            ("telegram_message", select(TelegramMessage.role,
+                                        TelegramMessage.body,
+                                        TelegramMessage.token_count,
+                                        TelegramMessage.model,
+                                        TelegramMessage.created_at)
+             .join(User, User.id == TelegramMessage.user_id)
+             .filter(TelegramMessage.user_id == user_id,
+                     TelegramMessage.body.is_not(None),
+                     or_(User.telegram_context_cleared_at.is_(None),
+                         TelegramMessage.created_at
+                         > User.telegram_context_cleared_at))
+             .order_by(TelegramMessage.created_at, TelegramMessage.id)),
+        )
+        for kind, query in queries:
+            rows = await db.stream(
+                query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+            async for row in rows:
+                yield {"type": kind, **row._asdict()}
+
+    @classmethod
+    async def export_chunks(cls, user_id: int) -> AsyncIterator[bytes]:
+        # Opens its own session: a StreamingResponse body runs after the
+        # request's dependencies have been closed.
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        pending = []
+        size = 0
+        async with AsyncSessionLocal() as db:
+            async for line in cls._export_lines(db, user_id):
+                data = compressor.compress(
+                    orjson.dumps(line, option=orjson.OPT_APPEND_NEWLINE)
+                )
+                if data:
+                    pending.append(data)
+                    size += len(data)
+                if size >= CHUNK_SIZE:
+                    yield b"".join(pending)
+                    pending = []
+                    size = 0
+        pending.append(compressor.flush())
+        yield b"".join(pending)
+
+    @staticmethod
+    def _too_large() -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"Imports are limited to {settings.IMPORT_MAX_ROWS} "
+            f"lines and {settings.IMPORT_MAX_BYTES} bytes uncompressed."
+        )
+
+    @classmethod
+    async def _lines(
+        cls, chunks: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        # Splits a gzip-compressed (or plain) NDJSON stream into lines,
+        # stopping at IMPORT_MAX_BYTES of uncompressed data.
+        decompressor = None
+        buffer = b""
+        size = 0
+        first = True
+        async for chunk in chunks:
+            if first and chunk:
+                first = False
+                if chunk[:2] == b"\x1f\x8b":
+                    decompressor = zlib.decompressobj(31)
+            data = chunk
+            while data:
+                if decompressor is not None:
+                    text = decompressor.decompress(data, MAX_LINE_LENGTH)
+                    data = decompressor.unconsumed_tail
+                else:
+                    text, data = data, b""
+                size += len(text)
+                if size > settings.IMPORT_MAX_BYTES:
+                    raise cls._too_large()
+                buffer += text
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    yield line
+                if len(buffer) > MAX_LINE_LENGTH:
+                    raise HTTPException(
+                        status_code=413, detail="Import line too long."
+                    )
+        if decompressor is not None:
+            text = decompressor.flush()
+            if size + len(text) > settings.IMPORT_MAX_BYTES:
+                raise cls._too_large()
+            buffer += text
+        if buffer:
+            yield buffer
+
+    @staticmethod
+    def _timestamp(value: str) -> datetime:
+        timestamp = datetime.fromisoformat(value)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return timestamp
+
+    @classmethod
+    def _message_row(cls, record: dict, **extra) -> dict:
+        if record.get("role") not in MESSAGE_ROLES:
+            raise ValueError("role")
+        if not isinstance(record.get("body"), str):
+            raise ValueError("body")
+        if not isinstance(record.get("token_count") or 0, int):
+            raise ValueError("token_count")
+        if not isinstance(record.get("model") or "", str):
+            raise ValueError("model")
+        return {
+            "role": record["role"],
+            "body": record["body"],
+            "token_count": record.get("token_count"),
+            "model": record.get("model"),
+            "created_at": cls._timestamp(record["created_at"]),
+            **extra,
+        }
+
+    @staticmethod
+    async def _insert(db: AsyncSession, table, rows: list) -> None:
+        if not rows:
+            return
+        if db.bind.dialect.name != "postgresql":
+            await db.execute(insert(table), rows)
+            return
+        # COPY through the session's asyncpg connection, inside the same
+        # transaction as the rest of the import.
+        # COPY skips column defaults, so the legacy JSON document (see
+        # Message.content) is added here.
+        legacy = "content" if table is Message else "message"
+        rows = [
+            {**row, legacy: orjson.dumps(
+                legacy_document(row["role"], row["body"])
+            ).decode()}
+            for row in rows
+        ]
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        columns = list(rows[0])
+        await raw.driver_connection.copy_records_to_table(
+            table.__tablename__,
+            records=[tuple(row[column] for column in columns) for row in rows],
+            columns=columns
+        )
+
+    @classmethod
+    async def import_chunks(
+        cls, db: AsyncSession, user_id: int, chunks: AsyncIterator[bytes]
+    ) -> dict:
+        # Imports into new tabs of user_id; Telegram messages are added to
+        # the user's Telegram history. Everything is committed at the end,
+        # or nothing if a line is invalid or the import is larger than
+        # IMPORT_MAX_ROWS lines or IMPORT_MAX_BYTES uncompressed.
+        tab_ids = {}
+        batches = {Message: [], TelegramMessage: []}
+        counts = {"tabs": 0, "messages": 0, "telegram_messages": 0}
+        number = 0
+        # Non-blank lines; the first one must be the header.
+        records = 0
+
+        async for line in cls._lines(chunks):
+            number += 1
+            if not line.strip():
+                continue
+            records += 1
+            if records > settings.IMPORT_MAX_ROWS + 1:
+                await db.rollback()
+                raise cls._too_large()
+            try:
+                record = orjson.loads(line)
+                kind = record["type"]
+                if records == 1:
+                    if (
+                        kind != "export"
+                        or record.get("version") != FORMAT_VERSION
+                    ):
+                        raise ValueError("header")
+                elif kind == "tab":
+                    tab = Tab(
+                        user_id=user_id, name=str(record["name"])[:50],
+                        created_at=cls._timestamp(record["created_at"])
+                    )
+                    db.add(tab)
+                    await db.flush()
+                    tab_ids[record["id"]] = tab.id
+                    counts["tabs"] += 1
+                elif kind == "message":
+                    batches[Message].append(cls._message_row(
+                        record, tab_id=tab_ids[record["tab_id"]],
+                        user_id=user_id
+                    ))
+                    counts["messages"] += 1
+                elif kind == "telegram_message":
+                    batches[TelegramMessage].append(
+                        cls._message_row(record, user_id=user_id)
+                    )
+                    counts["telegram_messages"] += 1
+                else:
+                    raise ValueError("type")
+            except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+                await db.rollback()
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Invalid import data on line {number}."
+                )
+
+            for table, rows in batches.items():
+                if len(rows) >= IMPORT_BATCH_SIZE:
+                    await cls._insert(db, table, rows)
+                    rows.clear()
+
+        if records == 0:
+            raise HTTPException(status_code=422, detail="The import is empty.")
+        for table, rows in batches.items():
+            await cls._insert(db, table, rows)
+        await TabService.refresh_counters(db, list(tab_ids.values()))
+        await db.commit()
+        return counts
@@ -0,0 +1,127 @@
+import random
+import time
+from typing import Mapping, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.upstream_scheduler import FairScheduler, upstream_scheduler
+
+
+concurrency_limit = metrics.gauge(
+    "upstream_concurrency_limit",
+    "Current upstream concurrency limit set by AIMD"
+)
+throttled_calls = metrics.counter(
+    "upstream_throttled_total",
+    "OpenAI calls rejected with 429"
+)
+retried_calls = metrics.counter(
+    "upstream_retries_total",
+    "OpenAI calls retried after a 429"
+)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return None
+
+
+def remaining_fraction(headers: Mapping[str, str]) -> Optional[float]:
+    fractions = []
+    for kind in ("requests", "tokens"):
+        try:
+            remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+            limit = float(headers[f"x-ratelimit-limit-{kind}"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if limit > 0:
+            fractions.append(remaining / limit)
+    return min(fractions) if fractions else None
+
+
+# Additive increase / multiplicative decrease of the upstream scheduler's
+# capacity, driven by OpenAI's x-ratelimit-* headers and 429 responses.
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        scheduler: FairScheduler,
+        min_limit: int,
+        max_limit: int,
+        low_water: float,
+        backoff_base: float,
+        retry_budget: float,
+        decrease_cooldown: float = 1.0
+    ):
+        self.scheduler = scheduler
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.low_water = low_water
+        self.backoff_base = backoff_base
+        self.retry_budget = retry_budget
+        self.decrease_cooldown = decrease_cooldown
+        self._limit = float(max_limit)
+        self._last_decrease = 0.0
+        concurrency_limit.set(max_limit)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_success(self, headers: Mapping[str, str]) -> None:
+        fraction = remaining_fraction(headers)
+        if fraction is not None and fraction < self.low_water:
+            self._decrease(0.9)
+        else:
+            self._set(self._limit + 1 / max(self._limit, 1))
+
+    def on_throttled(
+        self, headers: Mapping[str, str], attempt: int, started: float
+    ) -> Optional[float]:
+        # Returns how long to wait before the next attempt, or None when
+        # the retry would not fit into the latency budget.
+        throttled_calls.inc()
+        self._decrease(0.5)
+
+        backoff = self.backoff_base * (2 ** attempt)
+        delay = max(
+            parse_retry_after(headers) or 0,
+            random.uniform(backoff / 2, backoff)
+        )
+        if time.monotonic() - started + delay > self.retry_budget:
+            return None
+        retried_calls.inc()
+        return delay
+
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self._set(self._limit * factor)
+
+    def _set(self, value: float) -> None:
+        self._limit = min(max(value, self.min_limit), self.max_limit)
+        if int(self._limit) != self.scheduler.capacity:
+            self.scheduler.resize(int(self._limit))
+            concurrency_limit.set(int(self._limit))
+
+
+upstream_limiter = AdaptiveLimiter(
+    upstream_scheduler,
+    min_limit=settings.UPSTREAM_MIN_CONCURRENCY,
+    max_limit=settings.UPSTREAM_MAX_CONCURRENCY,
+    low_water=settings.UPSTREAM_RATELIMIT_LOW_WATER,
+    backoff_base=settings.UPSTREAM_RETRY_BASE_DELAY,
+    retry_budget=settings.UPSTREAM_RETRY_BUDGET
+)
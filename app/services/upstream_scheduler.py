@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Hashable
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.status_codes import StatusMessages
+
+
+queue_wait = metrics.summary(
+    "upstream_queue_wait_seconds",
+    "Time requests wait for an upstream slot, by plan"
+)
+rejected_requests = metrics.counter(
+    "upstream_queue_rejected_total",
+    "Requests rejected by the upstream scheduler, by plan and reason"
+)
+in_flight_requests = metrics.gauge(
+    "upstream_in_flight",
+    "Upstream calls currently in flight"
+)
+
+
+class _Waiter:
+    __slots__ = ("future", "cost", "weight")
+
+    def __init__(self, cost: int, weight: float):
+        self.future = asyncio.get_running_loop().create_future()
+        self.cost = cost
+        self.weight = weight
+
+
+# Deficit round-robin over per-user queues. Every user with waiting
+# requests gets `quantum * weight` tokens of credit per round and a
+# request is started once the user's credit covers its estimated cost,
+# so heavy users cannot take more than their weighted share of the
+# upstream slots while others are waiting.
+class FairScheduler:
+    def __init__(
+        self,
+        capacity: int,
+        quantum: int,
+        max_wait: float,
+        max_queue_per_user: int
+    ):
+        self.capacity = capacity
+        self.quantum = quantum
+        self.max_wait = max_wait
+        self.max_queue_per_user = max_queue_per_user
+        self._in_flight = 0
+        self._queues: Dict[Hashable, Deque[_Waiter]] = {}
+        self._deficits: Dict[Hashable, float] = {}
+        self._active: Deque[Hashable] = deque()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def resize(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._dispatch()
+
+    def try_acquire(self) -> bool:
+        if self._in_flight < self.capacity and not self._active:
+            self._start()
+            return True
+        return False
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, user_key: Hashable, plan: str, cost: int):
+        await self.acquire(user_key, plan, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_key: Hashable, plan: str, cost: int) -> None:
+        started = time.monotonic()
+        if self._in_flight < self.capacity and not self._active:
+            self._start()
+            queue_wait.observe(0.0, plan=plan)
+            return
+
+        queue = self._queues.get(user_key)
+        if queue is not None and len(queue) >= self.max_queue_per_user:
+            rejected_requests.inc(plan=plan, reason="queue_full")
+            raise self._busy()
+
+        waiter = _Waiter(max(cost, 1), plan_weight(plan))
+        if queue is None:
+            queue = self._queues[user_key] = deque()
+            self._deficits[user_key] = 0.0
+            self._active.append(user_key)
+        queue.append(waiter)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(waiter.future), self.max_wait
+            )
+        except asyncio.TimeoutError:
+            if self._abandon(user_key, waiter):
+                rejected_requests.inc(plan=plan, reason="timeout")
+                raise self._busy()
+        except asyncio.CancelledError:
+            if not self._abandon(user_key, waiter):
+                self.release()
+            raise
+        queue_wait.observe(time.monotonic() - started, plan=plan)
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        in_flight_requests.set(self._in_flight)
+        self._dispatch()
+
+    def _start(self) -> None:
+        self._in_flight += 1
+        in_flight_requests.set(self._in_flight)
+
+    def _abandon(self, user_key: Hashable, waiter: _Waiter) -> bool:
+        # Returns False when the slot was granted before we gave up, in
+        # which case the caller owns it. Otherwise the waiter leaves its
+        # queue right away: _dispatch() only clears queues while slots are
+        # free, and dead waiters would count against max_queue_per_user
+        # and keep try_acquire() from succeeding.
+        if waiter.future.done():
+            return False
+        waiter.future.cancel()
+        queue = self._queues.get(user_key)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                self._active.remove(user_key)
+                del self._queues[user_key]
+                del self._deficits[user_key]
+        self._dispatch()
+        return True
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self.capacity and self._active:
+            user_key = self._active[0]
+            queue = self._queues[user_key]
+            while queue and queue[0].future.done():
+                queue.popleft()
+            if not queue:
+                self._drop(user_key)
+                continue
+
+            waiter = queue[0]
+            if self._deficits[user_key] < waiter.cost:
+                self._deficits[user_key] += self.quantum * waiter.weight
+                self._active.rotate(-1)
+                continue
+
+            queue.popleft()
+            self._deficits[user_key] -= waiter.cost
+            self._start()
+            waiter.future.set_result(None)
+            if not queue:
+                self._drop(user_key)
+
+    def _drop(self, user_key: Hashable) -> None:
+        self._active.popleft()
+        del self._queues[user_key]
+        del self._deficits[user_key]
+
+    def _busy(self) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail=StatusMessages.UPSTREAM_BUSY,
+            headers={"Retry-After": str(max(1, int(self.max_wait)))}
+        )
+
+
+def plan_weight(plan: str) -> float:
+    weights = settings.UPSTREAM_PLAN_WEIGHTS
+    return max(float(weights.get(plan, weights.get("free", 1))), 0.01)
+
+
+upstream_scheduler = FairScheduler(
+    capacity=settings.UPSTREAM_MAX_CONCURRENCY,
+    quantum=settings.UPSTREAM_DRR_QUANTUM,
+    max_wait=settings.UPSTREAM_MAX_QUEUE_WAIT,
+    max_queue_per_user=settings.UPSTREAM_MAX_QUEUE_PER_USER
+)
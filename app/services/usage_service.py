@@ -0,0 +1,120 @@
+from datetime import date, datetime, timedelta, timezone
+
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.db.models import UsageDaily
+
+
+BUCKETS = ("day", "week", "month")
+MAX_RANGE_DAYS = 366
+COUNTERS = ("requests", "tokens_in", "tokens_out")
+
+
+class UsageService:
+    @staticmethod
+    async def record(
+        db: AsyncSession,
+        user_id: int,
+        source: str,
+        model: str,
+        tokens_in: int,
+        tokens_out: int
+    ) -> None:
+        # Does not commit: called in the transaction that settles the
+        # answer, so the rollup and the charge are committed together.
+        # The increment happens in the upsert, so concurrent answers on
+        # the same day add up instead of overwriting each other.
+        dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(UsageDaily).values(
+            user_id=user_id,
+            day=datetime.now(timezone.utc).date(),
+            source=source,
+            model=model or "unknown",
+            requests=1,
+            tokens_in=tokens_in,
+            tokens_out=tokens_out
+        )
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=["user_id", "day", "source", "model"],
+            set_={
+                "requests": UsageDaily.requests + 1,
+                "tokens_in": UsageDaily.tokens_in + statement.excluded.tokens_in,
+                "tokens_out": (
+                    UsageDaily.tokens_out + statement.excluded.tokens_out
+                ),
+            }
+        ))
+
+    @staticmethod
+    def bucket_start(day: date, bucket: str) -> date:
+        if bucket == "week":
+            return day - timedelta(days=day.weekday())
+        if bucket == "month":
+            return day.replace(day=1)
+        return day
+
+    @classmethod
+    async def summary(
+        cls,
+        db: AsyncSession,
+        user_id: int,
+        start: date,
+        end: date,
+        bucket: str
+    ) -> dict:
+        if bucket not in BUCKETS:
+            raise HTTPException(
+                status_code=422,
+                detail=f"bucket must be one of: {', '.join(BUCKETS)}."
+            )
+        if end < start or (end - start).days >= MAX_RANGE_DAYS:
+            raise HTTPException(
+                status_code=422,
+                detail=f"The range must cover 1 to {MAX_RANGE_DAYS} days."
+            )
+
+        # Reads at most one row per day, source and model, however many
+        # messages the user sent.
+        result = await db.execute(
+            select(UsageDaily)
+            .filter(
+                UsageDaily.user_id == user_id,
+                UsageDaily.day >= start,
+                UsageDaily.day <= end
+            )
+            .order_by(UsageDaily.day.asc())
+        )
+
+        totals = dict.fromkeys(COUNTERS, 0)
+        buckets = {}
+        for row in result.scalars().all():
+            key = cls.bucket_start(row.day, bucket)
+            entry = buckets.get(key)
+            if entry is None:
+                entry = buckets[key] = {
+                    "start": key.isoformat(),
+                    **dict.fromkeys(COUNTERS, 0),
+                    "by_source": {},
+                    "by_model": {},
+                }
+            for group, name in (
+                (entry, None),
+                (entry["by_source"], row.source),
+                (entry["by_model"], row.model),
+                (totals, None),
+            ):
+                if name is not None:
+                    group = group.setdefault(name, dict.fromkeys(COUNTERS, 0))
+                for counter in COUNTERS:
+                    group[counter] += getattr(row, counter)
+
+        return {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "bucket": bucket,
+            "totals": totals,
+            "buckets": list(buckets.values()),
+        }
@@ -7,6 +7,100 @@ document.addEventListener('DOMContentLoaded', () => {
 
     console.log('DOM loaded. Current Tab ID from localStorage:', currentTabId);
 
+    const socket = createChatSocket();
+
+    // One WebSocket carries tab operations and streamed answers for all
+    // tabs. Requests fall back to plain HTTP while it is not connected.
+    function createChatSocket() {
+        const pending = new Map();
+        const streams = new Map();
+        let ws = null;
+        let nextId = 1;
+        let retryDelay = 1000;
+
+        function connect() {
+            const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+            ws = new WebSocket(`${scheme}://${window.location.host}/ws/chat`);
+            ws.addEventListener('open', () => {
+                retryDelay = 1000;
+            });
+            ws.addEventListener('message', (event) => {
+                handleMessage(JSON.parse(event.data));
+            });
+            ws.addEventListener('close', (event) => {
+                pending.forEach(({ reject }) => reject(new Error('Connection closed')));
+                pending.clear();
+                streams.clear();
+                if (event.code === 4401) {
+                    return;
+                }
+                setTimeout(connect, retryDelay);
+                retryDelay = Math.min(retryDelay * 2, 30000);
+            });
+        }
+
+        function handleMessage(message) {
+            if (message.type === 'ping') {
+                ws.send(JSON.stringify({ type: 'pong' }));
+            } else if (message.type === 'balance') {
+                tokenBalance.textContent = message.tokens_remaining;
+            } else if (message.type === 'delta') {
+                const onDelta = streams.get(message.id);
+                if (onDelta) {
+                    onDelta(message.text);
+                }
+            } else if (message.type === 'result' || message.type === 'error') {
+                const request = pending.get(message.id);
+                if (!request) {
+                    return;
+                }
+                pending.delete(message.id);
+                streams.delete(message.id);
+                if (message.type === 'result') {
+                    request.resolve(message.data);
+                } else {
+                    const error = new Error(message.detail);
+                    error.status = message.status;
+                    error.retryAfter = message.retry_after;
+                    request.reject(error);
+                }
+            }
+        }
+
+        function isOpen() {
+            return ws !== null && ws.readyState === WebSocket.OPEN;
+        }
+
+        function request(type, payload, onDelta) {
+            const id = nextId++;
+            return new Promise((resolve, reject) => {
+                pending.set(id, { resolve, reject });
+                if (onDelta) {
+                    streams.set(id, onDelta);
+                }
+                ws.send(JSON.stringify({ id, type, ...payload }));
+            });
+        }
+
+        connect();
+        return { isOpen, request };
+    }
+
+    async function call(type, payload, fallback) {
+        if (socket.isOpen()) {
+            return socket.request(type, payload);
+        }
+        return fallback();
+    }
+
+    async function fetchJson(url, options) {
+        const response = await fetch(url, options);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        return response.json();
+    }
+
     const toggleTabsBtn = document.getElementById('toggle-tabs-btn');
     let tabsVisible = true;
 
@@ -37,19 +131,15 @@ document.addEventListener('DOMContentLoaded', () => {
     clearButton.addEventListener('click', async () => {
         if (currentTabId) {
             try {
-                const response = await fetch(`/clear_context/${currentTabId}`, {
+                await call('clear_context', { tab_id: currentTabId }, () => fetchJson(`/clear_context/${currentTabId}`, {
                     method: 'DELETE',
                     headers: {
                         'Content-Type': 'application/json',
                     }
-                });
-                if (response.ok) {
-                    document.getElementById(`chat-messages-${currentTabId}`).innerHTML = '';
-                } else {
-                    console.error('Error clearing context');
-                }
+                }));
+                document.getElementById(`chat-messages-${currentTabId}`).innerHTML = '';
             } catch (error) {
-                console.error('Error:', error);
+                console.error('Error clearing context:', error);
             }
         }
     });
@@ -141,42 +231,82 @@ document.addEventListener('DOMContentLoaded', () => {
         e.preventDefault();
         const message = userInput.value.trim();
         if (message && currentTabId) {
-            addMessage('user', message);
+            const tabId = parseInt(currentTabId, 10);
+            const container = document.getElementById(`chat-messages-${tabId}`);
+            addMessageToTab(container, 'user', message);
     
             userInput.value = '';
             userInput.style.height = 'auto';
-    
+
+            // One key per submit: if the request is sent again, the server
+            // replays the first answer instead of charging twice.
+            const idempotencyKey = window.crypto && crypto.randomUUID
+                ? crypto.randomUUID()
+                : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+            let streamed = null;
             try {
-                const response = await fetch('/chat', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({ message, tab_id: parseInt(currentTabId, 10) }),
-                });
-                const data = await response.json();
+                let data;
+                if (socket.isOpen()) {
+                    data = await socket.request('chat', { message, tab_id: tabId }, (text) => {
+                        if (!streamed) {
+                            streamed = addMessageToTab(container, 'bot', '');
+                        }
+                        streamed.textContent += text;
+                        container.scrollTop = container.scrollHeight;
+                    });
+                } else {
+                    const response = await fetch('/chat', {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/json',
+                            'Idempotency-Key': idempotencyKey,
+                        },
+                        body: JSON.stringify({ message, tab_id: tabId }),
+                    });
+                    if (response.status === 503) {
+                        const error = new Error('Service busy');
+                        error.status = 503;
+                        error.retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+                        throw error;
+                    }
+                    data = await response.json();
+                }
                 if (data.error) {
-                    addMessage('error', data.response);
+                    if (streamed) {
+                        streamed.parentElement.remove();
+                    }
+                    addMessageToTab(container, 'error', data.response);
                 } else {
-                    addMessage('bot', data.response);
+                    if (streamed) {
+                        streamed.innerHTML = formatMessageText(data.response);
+                    } else {
+                        addMessageToTab(container, 'bot', data.response);
+                    }
                     tokenBalance.textContent = data.tokens_remaining;
                 }
             } catch (error) {
                 console.error('Error:', error);
-                addMessage('error', 'Sorry, an error occurred. Please try again.');
+                if (streamed) {
+                    streamed.parentElement.remove();
+                }
+                if (error.status === 503) {
+                    const seconds = error.retryAfter > 0 ? error.retryAfter : 'a few';
+                    addMessageToTab(container, 'error', `The service is busy right now. Please try again in ${seconds} seconds.`);
+                } else {
+                    addMessageToTab(container, 'error', 'Sorry, an error occurred. Please try again.');
+                }
             }
         }
     });
 
     async function createNewTab() {
         try {
-            const response = await fetch('/create_tab', {
+            const data = await call('create_tab', {}, () => fetchJson('/create_tab', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 }
-            });
-            const data = await response.json();
+            }));
             const tabId = data.tab_id;
             const tabName = data.name;
             addTab(tabId, tabName);
@@ -188,44 +318,37 @@ document.addEventListener('DOMContentLoaded', () => {
 
     async function deleteTab(tabId) {
         try {
-            const response = await fetch(`/delete_tab/${tabId}`, {
+            await call('delete_tab', { tab_id: parseInt(tabId, 10) }, () => fetchJson(`/delete_tab/${tabId}`, {
                 method: 'DELETE',
                 headers: {
                     'Content-Type': 'application/json',
                 }
-            });
-            if (response.ok) {
-                const tabButton = document.querySelector(`button[data-tab-id="${tabId}"]`);
-                tabButton.remove();
-                document.getElementById(`chat-messages-${tabId}`).remove();
-
-                if (currentTabId === tabId) {
-                    localStorage.removeItem('currentTabId');
-                    currentTabId = null;
-                    hideAllTabs();
-                }
-            } else {
-                console.error('Error deleting tab');
+            }));
+            const tabButton = document.querySelector(`button[data-tab-id="${tabId}"]`);
+            tabButton.remove();
+            document.getElementById(`chat-messages-${tabId}`).remove();
+
+            if (currentTabId === tabId) {
+                localStorage.removeItem('currentTabId');
+                currentTabId = null;
+                hideAllTabs();
             }
         } catch (error) {
-            console.error('Error:', error);
+            console.error('Error deleting tab:', error);
         }
     }
 
     async function renameTab(tabId, newName) {
         try {
-            const response = await fetch(`/rename_tab/${tabId}`, {
+            await call('rename_tab', { tab_id: parseInt(tabId, 10), new_name: newName }, () => fetchJson(`/rename_tab/${tabId}`, {
                 method: 'PUT',
                 headers: {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({ new_name: newName })
-            });
-            if (!response.ok) {
-                console.error('Error renaming tab');
-            }
+            }));
         } catch (error) {
-            console.error('Error:', error);
+            console.error('Error renaming tab:', error);
         }
     }
 
@@ -269,8 +392,9 @@ document.addEventListener('DOMContentLoaded', () => {
         chatMessagesContainer.innerHTML = '';
     
         try {
-            const response = await fetch(`/get_tab_messages/${currentTabId}`);
-            const messages = await response.json();
+            const messages = await call('get_tab_messages', { tab_id: currentTabId }, async () => ({
+                messages: await fetchJson(`/get_tab_messages/${currentTabId}`)
+            })).then(data => data.messages);
             messages.forEach(msg => {
                 const senderClass = msg.sender === 'user' ? 'user' : 'bot';
                 addMessageToTab(chatMessagesContainer, senderClass, msg.text);
@@ -298,6 +422,7 @@ document.addEventListener('DOMContentLoaded', () => {
         messageElement.appendChild(textElement);
         container.appendChild(messageElement);
         container.scrollTop = container.scrollHeight;
+        return textElement;
     }
 
     function addMessage(sender, text) {
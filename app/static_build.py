@@ -0,0 +1,147 @@
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+
+from app.core.static_assets import (
+    DIST_DIRNAME,
+    IMAGE_TYPES,
+    MANIFEST_NAME,
+    STATIC_DIR,
+    STATIC_URL,
+    TEXT_TYPES,
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+CSS_URL = re.compile(r"""url\((['"]?)(/static/[^'")]+)\1\)""")
+
+
+def fingerprint(path: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.{digest}{extension}"
+
+
+def rewrite_css(data: bytes, manifest: dict) -> bytes:
+    def replace(match):
+        path = match.group(2)[len(STATIC_URL) + 1:]
+        if path not in manifest:
+            return match.group(0)
+        quote = match.group(1)
+        return f"url({quote}{STATIC_URL}/{DIST_DIRNAME}/{manifest[path]}{quote})"
+
+    return CSS_URL.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+
+def compress_variants(data: bytes) -> dict:
+    # mtime=0 keeps the output identical between builds.
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    return variants
+
+
+def webp_variant(data: bytes, quality: int) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        output = io.BytesIO()
+        image.save(output, format="WEBP", quality=quality, method=6)
+        return output.getvalue()
+
+
+def _sources(static_dir: str):
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [
+            name for name in dirs
+            if not (root == static_dir and name == DIST_DIRNAME)
+        ]
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            yield os.path.relpath(full_path, static_dir).replace(os.sep, "/")
+
+
+def build(static_dir: str = STATIC_DIR, webp_quality: int = 80) -> dict:
+    dist_dir = os.path.join(static_dir, DIST_DIRNAME)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+
+    if brotli is None:
+        logger.warning("brotli is not installed; writing gzip variants only.")
+    if Image is None:
+        logger.warning("Pillow is not installed; skipping WebP variants.")
+
+    # Stylesheets last, so the url() references they contain can be
+    # rewritten to the fingerprinted names.
+    sources = sorted(_sources(static_dir), key=lambda path: path.endswith(".css"))
+    manifest = {}
+    original_bytes = 0
+    served_bytes = 0
+    for path in sources:
+        with open(os.path.join(static_dir, path), "rb") as source:
+            data = source.read()
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".css":
+            data = rewrite_css(data, manifest)
+
+        target = fingerprint(path, data)
+        variants = {"": data}
+        if extension in TEXT_TYPES:
+            variants.update(compress_variants(data))
+        elif extension in IMAGE_TYPES and Image is not None:
+            variants[".webp"] = webp_variant(data, webp_quality)
+
+        smallest = len(data)
+        for suffix, content in variants.items():
+            # A variant that is not smaller than the original is useless.
+            if suffix and len(content) >= len(data):
+                continue
+            smallest = min(smallest, len(content))
+            output_path = os.path.join(dist_dir, target + suffix)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, "wb") as output:
+                output.write(content)
+
+        manifest[path] = target
+        original_bytes += len(data)
+        served_bytes += smallest
+        logger.info(f"{path} -> {target} ({len(data)} -> {smallest} bytes)")
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), "w") as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+
+    logger.info(
+        f"Built {len(manifest)} assets: {original_bytes} bytes, "
+        f"{served_bytes} bytes in the best variants."
+    )
+    return manifest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.static_build")
+    parser.add_argument("--static-dir", default=STATIC_DIR)
+    parser.add_argument("--webp-quality", type=int, default=80)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    build(args.static_dir, args.webp_quality)
+
+
+if __name__ == '__main__':
+    main()
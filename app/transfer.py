@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+from fastapi import HTTPException
+
+from app.core.logging_config import setup_logging
+from app.db.init_db import AsyncSessionLocal, engine
+from app.services.transfer_service import CHUNK_SIZE, TransferService
+
+
+logger = logging.getLogger(__name__)
+
+
+async def export_history(user_id: int, output: str) -> None:
+    stream = sys.stdout.buffer if output == "-" else open(output, "wb")
+    try:
+        async for chunk in TransferService.export_chunks(user_id):
+            stream.write(chunk)
+    finally:
+        if stream is not sys.stdout.buffer:
+            stream.close()
+
+
+async def import_history(user_id: int, path: str) -> dict:
+    async def chunks():
+        stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+    async with AsyncSessionLocal() as db:
+        return await TransferService.import_chunks(db, user_id, chunks())
+
+
+async def main(args) -> int:
+    setup_logging()
+    try:
+        if args.command == "export":
+            await export_history(args.user_id, args.output)
+        else:
+            counts = await import_history(args.user_id, args.input)
+            logger.info(f"Imported {counts}")
+    except HTTPException as e:
+        logger.error(e.detail)
+        return 1
+    finally:
+        await engine.dispose()
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="python -m app.transfer")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser(
+        "export", help="Write a user's history as gzip NDJSON"
+    )
+    export_parser.add_argument("--user-id", type=int, required=True)
+    export_parser.add_argument("--output", default="-")
+
+    import_parser = subparsers.add_parser(
+        "import", help="Add an exported history to a user's account"
+    )
+    import_parser.add_argument("--user-id", type=int, required=True)
+    import_parser.add_argument("input", nargs="?", default="-")
+
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import signal
+import socket
+
+import aioredis
+from aiohttp import ClientSession, ClientTimeout
+from fastapi import HTTPException
+
+from app.core import resources
+from app.core.config import settings
+from app.core.resources import redis_client
+from app.core.logging_config import setup_logging
+from app.core.status_codes import StatusMessages
+from app.db.init_db import AsyncSessionLocal
+from app.db.models import Tab, User
+from app.services.chat_service import ChatService
+from app.services.job_service import JobService
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChatWorker:
+    def __init__(self, redis_client, name: str, concurrency: int):
+        self.redis = redis_client
+        self.name = name
+        self.slots = asyncio.Semaphore(concurrency)
+        self.tasks = set()
+        self.stopping = asyncio.Event()
+
+    async def run(self) -> None:
+        try:
+            await self.redis.xgroup_create(
+                settings.JOB_STREAM, settings.JOB_GROUP,
+                id="0", mkstream=True
+            )
+        except aioredis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        # Entries delivered to this consumer before a restart and never
+        # acknowledged come first ("0"), then new entries (">"). Between
+        # reads, entries left pending by other consumers for longer than
+        # JOB_CLAIM_IDLE (a worker that crashed or was replaced under a new
+        # name) are claimed and run here.
+        last_id = "0"
+        claim_cursor = "0-0"
+        next_claim = 0.0
+        loop = asyncio.get_running_loop()
+        while not self.stopping.is_set():
+            await self.slots.acquire()
+            try:
+                entry = None
+                if last_id == ">" and loop.time() >= next_claim:
+                    claim_cursor, entry = await self._autoclaim(claim_cursor)
+                    if claim_cursor == "0-0":
+                        next_claim = loop.time() + settings.JOB_CLAIM_IDLE / 3
+                if entry is None:
+                    response = await self.redis.xreadgroup(
+                        settings.JOB_GROUP, self.name,
+                        {settings.JOB_STREAM: last_id},
+                        count=1, block=5000
+                    )
+                    entries = response[0][1] if response else []
+                    if not entries:
+                        if last_id == "0":
+                            last_id = ">"
+                    else:
+                        entry = entries[0]
+                        if last_id != ">":
+                            last_id = entry[0]
+            except Exception:
+                self.slots.release()
+                raise
+
+            if entry is None:
+                self.slots.release()
+                continue
+            entry_id, fields = entry
+            if not fields:
+                # Pending entry trimmed from the stream in the meantime.
+                await self.redis.xack(
+                    settings.JOB_STREAM, settings.JOB_GROUP, entry_id
+                )
+                self.slots.release()
+                continue
+
+            task = asyncio.create_task(self._process(entry_id, fields))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def _autoclaim(self, cursor: str):
+        # XAUTOCLAIM is not wrapped by aioredis 2.0. Returns the next cursor
+        # ("0-0" once the whole pending list was scanned) and the claimed
+        # entry, if any.
+        response = await self.redis.execute_command(
+            "XAUTOCLAIM", settings.JOB_STREAM, settings.JOB_GROUP, self.name,
+            int(settings.JOB_CLAIM_IDLE * 1000), cursor, "COUNT", 1
+        )
+        cursor, entries = response[0], response[1]
+        for entry in entries:
+            if entry is None:
+                continue
+            entry_id, values = entry
+            values = values or []
+            return cursor, (entry_id, dict(zip(values[::2], values[1::2])))
+        return cursor, None
+
+    async def _heartbeat(self, entry_id: str) -> None:
+        # Claiming an entry resets its idle time, so other workers do not
+        # take over a job that is still running here.
+        while True:
+            await asyncio.sleep(settings.JOB_CLAIM_IDLE / 3)
+            await self.redis.xclaim(
+                settings.JOB_STREAM, settings.JOB_GROUP, self.name,
+                0, [entry_id], justid=True
+            )
+
+    async def _process(self, entry_id: str, fields: dict) -> None:
+        job_id = fields["job_id"]
+        heartbeat = asyncio.create_task(self._heartbeat(entry_id))
+        try:
+            job = await JobService.get(self.redis, job_id)
+            if job is None or job["status"] in (
+                JobService.DONE, JobService.FAILED
+            ):
+                # A redelivered job that already finished (the worker died
+                # before acknowledging it), or one whose record expired and
+                # can no longer be fetched: running it again would answer
+                # and charge twice.
+                await self.redis.xack(
+                    settings.JOB_STREAM, settings.JOB_GROUP, entry_id
+                )
+                if job is not None and fields.get("callback_url"):
+                    await self._callback(fields["callback_url"], job)
+                return
+
+            await JobService.set_running(self.redis, job_id)
+            try:
+                result = await self._run_job(
+                    fields["kind"], json.loads(fields["payload"])
+                )
+                status_code = 200
+            except HTTPException as e:
+                result = {"detail": e.detail}
+                status_code = e.status_code
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                result = {"detail": StatusMessages.SERVER_ERROR}
+                status_code = 500
+
+            await JobService.set_result(self.redis, job_id, result, status_code)
+            await self.redis.xack(
+                settings.JOB_STREAM, settings.JOB_GROUP, entry_id
+            )
+            if fields.get("callback_url"):
+                await self._callback(
+                    fields["callback_url"],
+                    await JobService.get(self.redis, job_id)
+                )
+        finally:
+            heartbeat.cancel()
+            self.slots.release()
+
+    async def _run_job(self, kind: str, payload: dict) -> dict:
+        async with AsyncSessionLocal() as db:
+            user = await db.get(User, payload["user_id"])
+            if user is None:
+                raise HTTPException(status_code=404, detail="User not found")
+
+            if kind == "chat":
+                tab = await db.get(Tab, payload["tab_id"])
+                if (
+                    tab is None or tab.user_id != user.id
+                    or tab.deleted_at is not None
+                ):
+                    raise HTTPException(
+                        status_code=404, detail="Tab not found."
+                    )
+                return await ChatService.answer_in_tab(
+                    db, user, tab, payload["text"], payload["tokens_needed"]
+                )
+            return await ChatService.answer_in_telegram(
+                db, user, payload["text"], payload["tokens_needed"]
+            )
+
+    @staticmethod
+    async def _callback(url: str, job: dict) -> None:
+        try:
+            async with ClientSession() as session:
+                async with session.post(
+                    url, json=job, timeout=ClientTimeout(total=10)
+                ) as response:
+                    if response.status >= 400:
+                        logger.warning(
+                            f"Callback for job {job['job_id']} returned "
+                            f"HTTP {response.status}"
+                        )
+        except Exception as e:
+            logger.warning(
+                f"Callback for job {job['job_id']} failed: {str(e)}"
+            )
+
+
+async def main() -> None:
+    setup_logging()
+    worker = ChatWorker(
+        redis_client,
+        name=settings.JOB_WORKER_NAME or socket.gethostname(),
+        concurrency=settings.JOB_WORKER_CONCURRENCY
+    )
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stopping.set)
+
+    logger.info(f"Worker {worker.name} consuming {settings.JOB_STREAM}")
+    await worker.run()
+    await resources.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,262 @@
+"""Microbenchmarks for the helpers that run on every request.
+
+Usage:
+    python -m benchmarks.hotpath run --output benchmarks/results/current.json
+    python -m benchmarks.hotpath run --save-baseline
+    python -m benchmarks.hotpath compare benchmarks/results/current.json
+
+``compare`` exits with status 1 when any benchmark's median is slower than
+the baseline by more than ``--threshold`` (a fraction, 0.10 by default).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+from benchmarks import BENCH_ENV
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+BASELINE_PATH = BENCH_DIR / "baselines" / "hotpath.json"
+
+for _name, _value in BENCH_ENV.items():
+    os.environ.setdefault(_name, _value)
+
+QUESTION = (
+    "How do I read a large CSV file in chunks with pandas and aggregate "
+    "the values per day without running out of memory? "
+) * 4
+
+ANSWER = (
+    "You can pass `chunksize` to `read_csv`:\n\n"
+    "```py\nfor chunk in pd.read_csv(path, chunksize=100_000):\n"
+    "    totals.append(chunk.groupby('day')['value'].sum())\n```\n\n"
+    "Then concatenate the partial results and sum them again.\n"
+) * 3
+
+
+def _context(size):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": QUESTION if i % 2 == 0 else ANSWER,
+        }
+        for i in range(size)
+    ]
+
+
+def _benchmarks():
+    from jinja2 import Environment, FileSystemLoader
+
+    from app.bot.telegram_bot import format_code_blocks
+    from app.core.static_assets import asset_url
+    from app.core.status_codes import StatusMessages
+    from app.services.auth import AuthService
+    from app.services.openai_service import build_context
+    from app.services.token_service import TokenService
+
+    context = _context(60)
+    token = AuthService.create_access_token(
+        data={"sub": "bench@example.com"},
+        expires_delta=timedelta(minutes=120)
+    )
+
+    templates = Environment(
+        loader=FileSystemLoader(str(ROOT_DIR / "app" / "templates")),
+        autoescape=True
+    )
+    templates.globals["asset_url"] = asset_url
+    index_template = templates.get_template("index.html")
+    chat_template = templates.get_template("chat.html")
+    user = SimpleNamespace(id=1, email="bench@example.com", tokens=2000)
+    tabs = [
+        {
+            "id": i,
+            "name": f"Tab {i}",
+            "created_at": "2024-08-23T10:00:00+00:00",
+            "updated_at": None,
+        }
+        for i in range(1, 21)
+    ]
+
+    return {
+        "token_service.count_tokens.question": lambda: (
+            TokenService.count_tokens(QUESTION)
+        ),
+        "token_service.count_tokens.answer": lambda: (
+            TokenService.count_tokens(ANSWER)
+        ),
+        "openai_service.build_context": lambda: (
+            build_context(QUESTION, context)
+        ),
+        "auth.create_access_token": lambda: AuthService.create_access_token(
+            data={"sub": "bench@example.com"},
+            expires_delta=timedelta(minutes=120)
+        ),
+        "auth.decode_access_token": lambda: AuthService.decode_access_token(
+            token
+        ),
+        "status_messages.get_message_limit_text": lambda: (
+            StatusMessages.get_message_limit_text(100)
+        ),
+        "status_messages.unexpected_error": lambda: (
+            StatusMessages.UNEXPECTED_ERROR.format(status=502)
+        ),
+        "telegram_bot.format_code_blocks": lambda: (
+            format_code_blocks(ANSWER)
+        ),
+        "templates.index_html": lambda: index_template.render(
+            request=None,
+            current_user=user,
+            telegram_bot_url="https://t.me/bench_bot",
+            tokens_remaining=user.tokens,
+            bot_token="x" * 43
+        ),
+        "templates.chat_html": lambda: chat_template.render(
+            request=None,
+            current_user=user,
+            tokens_remaining=user.tokens,
+            tabs=tabs,
+            first_tab_id=1
+        ),
+    }
+
+
+def _calibrate(func, min_time):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return number
+        number *= 2
+
+
+def measure(func, rounds, min_time):
+    number = _calibrate(func, min_time)
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "stddev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "rounds": rounds,
+        "iterations": number,
+    }
+
+
+def run(args):
+    benchmarks = _benchmarks()
+    selected = {
+        name: func for name, func in benchmarks.items()
+        if not args.filter or args.filter in name
+    }
+    results = {}
+    for name, func in selected.items():
+        results[name] = measure(func, args.rounds, args.min_time)
+        print(f"{name:45} {results[name]['median'] * 1e6:12.2f} us")
+
+    report = {
+        "machine": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "architecture": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "benchmarks": results,
+    }
+    output = BASELINE_PATH if args.save_baseline else args.output
+    if output:
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2, sort_keys=True))
+        print(f"Results written to {output}")
+    return 0
+
+
+def compare(args):
+    baseline_path = Path(args.baseline)
+    if not baseline_path.exists():
+        print(
+            f"No baseline at {baseline_path}; record one with "
+            f"python -m benchmarks.hotpath run --save-baseline"
+        )
+        return 2
+    baseline_report = json.loads(baseline_path.read_text())
+    baseline = baseline_report["benchmarks"]
+    current_report = json.loads(Path(args.current).read_text())
+    current = current_report["benchmarks"]
+    before_machine = baseline_report.get("machine", {})
+    after_machine = current_report.get("machine", {})
+    if any(
+        before_machine[key] != after_machine[key]
+        for key in before_machine.keys() & after_machine.keys()
+    ):
+        print(
+            f"Note: the baseline was recorded on {before_machine}; "
+            f"comparisons across machines or interpreters are not "
+            f"meaningful."
+        )
+
+    regressions = []
+    for name in sorted(current):
+        if name not in baseline:
+            print(f"{name:45} {'new':>12}")
+            continue
+        before = baseline[name]["median"]
+        after = current[name]["median"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        print(f"{name:45} {change * 100:+11.1f}%{flag}")
+
+    if regressions:
+        print(
+            f"{len(regressions)} benchmark(s) regressed by more than "
+            f"{args.threshold * 100:.0f}%: {', '.join(regressions)}"
+        )
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.hotpath")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--output")
+    run_parser.add_argument("--save-baseline", action="store_true")
+    run_parser.add_argument("--rounds", type=int, default=15)
+    run_parser.add_argument("--min-time", type=float, default=0.02)
+    run_parser.add_argument("--filter")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    compare_parser.add_argument("--threshold", type=float, default=0.10)
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(ROOT_DIR))
+    sys.exit(main())
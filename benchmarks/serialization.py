@@ -0,0 +1,122 @@
+"""Before/after benchmarks for serializing long tab histories.
+
+Usage:
+    python -m benchmarks.serialization run --messages 10000
+
+"Before" is what get_tab_messages did with FastAPI's defaults:
+jsonable_encoder followed by the stdlib encoder in JSONResponse, and
+json.loads for every JSON column value. "After" is orjson end to end.
+Compression rows show the cost and size of compressing the response body.
+"""
+import argparse
+import gzip
+import json
+import sys
+
+from benchmarks.hotpath import ANSWER, QUESTION, ROOT_DIR, measure
+
+
+def _rows(count):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": QUESTION if i % 2 == 0 else ANSWER,
+        }
+        for i in range(count)
+    ]
+
+
+def _tab_messages(rows):
+    return [
+        {"sender": "user" if row["role"] == "user" else "assistant",
+         "text": row["content"]} for row in rows
+    ]
+
+
+def _stdlib_render(content):
+    # starlette.responses.JSONResponse.render
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _benchmarks(count):
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+
+    rows = _rows(count)
+    stdlib_columns = [json.dumps(row) for row in rows]
+    orjson_columns = [orjson.dumps(row).decode() for row in rows]
+    body = orjson.dumps(_tab_messages(rows))
+
+    benchmarks = {
+        "decode_columns.before": lambda: [
+            json.loads(value) for value in stdlib_columns
+        ],
+        "decode_columns.after": lambda: [
+            orjson.loads(value) for value in orjson_columns
+        ],
+        "render_tab_messages.before": lambda: _stdlib_render(
+            jsonable_encoder(_tab_messages(rows))
+        ),
+        "render_tab_messages.after": lambda: orjson.dumps(
+            _tab_messages(rows)
+        ),
+        "compress.gzip_6": lambda: gzip.compress(body, compresslevel=6),
+    }
+    sizes = {
+        "body": len(body),
+        "compress.gzip_6": len(gzip.compress(body, compresslevel=6)),
+    }
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        benchmarks["compress.brotli_4"] = lambda: brotli.compress(
+            body, quality=4
+        )
+        sizes["compress.brotli_4"] = len(brotli.compress(body, quality=4))
+    return benchmarks, sizes
+
+
+def run(args):
+    benchmarks, sizes = _benchmarks(args.messages)
+    results = {
+        name: measure(func, args.rounds, args.min_time)
+        for name, func in benchmarks.items()
+    }
+
+    print(f"{args.messages} messages, response body {sizes['body']} bytes")
+    for name, result in results.items():
+        line = f"{name:32} {result['median'] * 1e3:10.2f} ms"
+        if name.endswith(".after"):
+            before = results[name[:-len(".after")] + ".before"]["median"]
+            line += f"   {before / result['median']:6.1f}x faster"
+        if name in sizes:
+            line += f"   {sizes[name]} bytes"
+        print(line)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.serialization")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--messages", type=int, default=10000)
+    run_parser.add_argument("--rounds", type=int, default=7)
+    run_parser.add_argument("--min-time", type=float, default=0.2)
+    run_parser.set_defaults(handler=run)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(ROOT_DIR))
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""Import-time budget for the service entry points.
+
+Every module is imported in a fresh interpreter with ``-X importtime``, so
+the numbers are what a new API replica, job worker or bot process pays
+before it can do any work.
+
+Usage:
+    python -m benchmarks.startup run --output benchmarks/results/startup.json
+    python -m benchmarks.startup run --save-baseline
+    python -m benchmarks.startup compare benchmarks/results/startup.json
+    python -m benchmarks.startup run --budget app.main=900 --budget app.worker=900
+
+``run`` prints the slowest top-level packages per module and exits with
+status 1 when a module's median import time exceeds its budget (in
+milliseconds): ``DEFAULT_BUDGETS`` unless ``--budget`` overrides it. ``compare`` exits with status 1 when a module is slower than
+the baseline by more than ``--threshold`` (a fraction, 0.10 by default).
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks import BENCH_ENV
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+BASELINE_PATH = BENCH_DIR / "baselines" / "startup.json"
+
+MODULES = [
+    "app.main",
+    "app.worker",
+    "app.db.migrate",
+    "app.bot.telegram_bot",
+]
+
+# Milliseconds, about 1.5 times the medians in baselines/startup.json
+# (app.main 1870 ms, app.worker 1750 ms, measured on the machine recorded
+# there), which leaves room for run-to-run noise but not for a new heavy
+# import on the startup path.
+DEFAULT_BUDGETS = {
+    "app.main": 2800,
+    "app.worker": 2800,
+}
+
+IMPORTTIME_LINE = re.compile(
+    r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$"
+)
+
+
+def _environment():
+    env = dict(os.environ)
+    for name, value in BENCH_ENV.items():
+        env.setdefault(name, value)
+    env.pop("PYTHONIMPORTTIME", None)
+    return env
+
+
+def parse_importtime(stderr, module):
+    # Lines are printed when an import finishes, children before their
+    # parent, indented by two spaces per nesting level.
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append((
+                int(match.group(1)),
+                int(match.group(2)),
+                len(match.group(3)) // 2,
+                match.group(4),
+            ))
+
+    # The module's own line covers everything it imports; its parent
+    # packages are separate top-level lines printed before it.
+    parents = module.split(".")
+    roots = {".".join(parents[:i]) for i in range(1, len(parents) + 1)}
+    total_us = sum(
+        cumulative_us for _, cumulative_us, level, name in entries
+        if level == 0 and name in roots
+    )
+    return total_us, entries
+
+
+def attribute_packages(entries, module):
+    # Self time of every import below the module, grouped by the
+    # top-level package that owns it (openai, sqlalchemy, jinja2, ...).
+    parents = module.split(".")
+    roots = {".".join(parents[:i]) for i in range(1, len(parents) + 1)}
+    packages = defaultdict(int)
+    subtree = []
+    for self_us, cumulative_us, level, name in entries:
+        subtree.append((self_us, name))
+        if level != 0:
+            continue
+        if name in roots:
+            for child_self_us, child_name in subtree:
+                packages[child_name.split(".")[0]] += child_self_us
+        subtree = []
+    return dict(packages)
+
+
+def measure_module(module, rounds):
+    env = _environment()
+    command = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    # One untimed import so bytecode is compiled and cached.
+    subprocess.run(
+        command, cwd=ROOT_DIR, env=env, capture_output=True, check=True
+    )
+
+    import_samples = []
+    process_samples = []
+    packages = {}
+    for _ in range(rounds):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            command, cwd=ROOT_DIR, env=env, capture_output=True, text=True
+        )
+        process_samples.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            raise RuntimeError(
+                f"import {module} failed:\n{completed.stderr[-2000:]}"
+            )
+        total_us, entries = parse_importtime(completed.stderr, module)
+        import_samples.append(total_us / 1e6)
+        packages = attribute_packages(entries, module)
+
+    return {
+        "import_median": statistics.median(import_samples),
+        "import_min": min(import_samples),
+        "process_median": statistics.median(process_samples),
+        "rounds": rounds,
+        "packages": {
+            name: us / 1e6 for name, us in sorted(
+                packages.items(), key=lambda item: item[1], reverse=True
+            )
+        },
+    }
+
+
+def _parse_budgets(values):
+    budgets = {
+        module: milliseconds / 1000
+        for module, milliseconds in DEFAULT_BUDGETS.items()
+    }
+    for value in values or []:
+        module, _, milliseconds = value.partition("=")
+        budgets[module] = float(milliseconds) / 1000
+    return budgets
+
+
+def run(args):
+    budgets = _parse_budgets(args.budget)
+    modules = args.module or MODULES
+    results = {}
+    over_budget = []
+    for module in modules:
+        result = measure_module(module, args.rounds)
+        results[module] = result
+        print(
+            f"{module:30} import {result['import_median'] * 1e3:8.1f} ms"
+            f"   process {result['process_median'] * 1e3:8.1f} ms"
+        )
+        for name, seconds in list(result["packages"].items())[:args.top]:
+            print(f"    {name:26} {seconds * 1e3:8.1f} ms")
+        budget = budgets.get(module)
+        if budget is not None and result["import_median"] > budget:
+            over_budget.append(
+                f"{module} ({result['import_median'] * 1e3:.0f} ms > "
+                f"{budget * 1e3:.0f} ms)"
+            )
+
+    report = {
+        "machine": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "architecture": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "modules": results,
+    }
+    output = BASELINE_PATH if args.save_baseline else args.output
+    if output:
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2, sort_keys=True))
+        print(f"Results written to {output}")
+
+    if over_budget:
+        print(f"Over the import-time budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+def compare(args):
+    baseline_path = Path(args.baseline)
+    if not baseline_path.exists():
+        print(
+            f"No baseline at {baseline_path}; record one with "
+            f"python -m benchmarks.startup run --save-baseline"
+        )
+        return 2
+    baseline_report = json.loads(baseline_path.read_text())
+    baseline = baseline_report["modules"]
+    current_report = json.loads(Path(args.current).read_text())
+    current = current_report["modules"]
+    before_machine = baseline_report.get("machine", {})
+    after_machine = current_report.get("machine", {})
+    if any(
+        before_machine[key] != after_machine[key]
+        for key in before_machine.keys() & after_machine.keys()
+    ):
+        print(
+            f"Note: the baseline was recorded on {before_machine}; "
+            f"comparisons across machines or interpreters are not "
+            f"meaningful."
+        )
+
+    regressions = []
+    for module in sorted(current):
+        if module not in baseline:
+            print(f"{module:30} {'new':>12}")
+            continue
+        before = baseline[module]["import_median"]
+        after = current[module]["import_median"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  SLOWER"
+            regressions.append(module)
+        print(f"{module:30} {change * 100:+11.1f}%{flag}")
+
+        new_packages = set(current[module]["packages"]) - set(
+            baseline[module]["packages"]
+        )
+        if new_packages:
+            print(f"    newly imported: {', '.join(sorted(new_packages))}")
+
+    if regressions:
+        print(
+            f"{len(regressions)} module(s) regressed by more than "
+            f"{args.threshold * 100:.0f}%: {', '.join(regressions)}"
+        )
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--module", action="append")
+    run_parser.add_argument("--output")
+    run_parser.add_argument("--save-baseline", action="store_true")
+    run_parser.add_argument("--rounds", type=int, default=7)
+    run_parser.add_argument("--top", type=int, default=8)
+    run_parser.add_argument(
+        "--budget", action="append", metavar="MODULE=MILLISECONDS"
+    )
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    compare_parser.add_argument("--threshold", type=float, default=0.10)
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(ROOT_DIR))
+    sys.exit(main())